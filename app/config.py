@@ -10,6 +10,12 @@ class Settings(BaseSettings):
     ADMIN_TOKEN: str = Field(default="")
     DATABASE_URL: str = Field(default="sqlite:///./signals.db")
 
+    # DB jungčių pool'as (taikoma ne-sqlite DB)
+    DB_POOL_SIZE: int = Field(default=10)
+    DB_MAX_OVERFLOW: int = Field(default=5)
+    DB_POOL_RECYCLE: int = Field(default=1800)  # sekundėmis
+    DB_QUERY_CACHE_SIZE: int = Field(default=1200)  # sukompiliuotų SQL užklausų cache
+
     # Feature switches
     ENABLE_TELEGRAM: bool = Field(default=True)
     ENABLE_SCHEDULER: bool = Field(default=True)
@@ -18,6 +24,11 @@ class Settings(BaseSettings):
     TWELVEDATA_API_KEY: str = Field(default="")  # ⬅️ BŪTINA nustatyti Railway Variables
     TD_MAX_PER_MINUTE: int = Field(default=8)
     TD_MAX_PER_DAY: int = Field(default=800)
+    TD_MAX_WAIT_SECONDS: float = Field(default=10.0)  # kiek ilgiausiai laukti TD žetono
+    TD_BATCH_SIZE: int = Field(default=120)  # simbolių per vieną /time_series batch kvietimą
+
+    # HTTP klientas (jungčių pool'as tiekėjų užklausoms)
+    HTTP_POOL_SIZE: int = Field(default=64)
 
     # Shutdown
     SHUTDOWN_TIMEOUT_SECONDS: int = Field(default=5)
@@ -25,15 +36,29 @@ class Settings(BaseSettings):
     # Signals / scanning
     DEFAULT_TIMEFRAMES: str = Field(default="1h,1d")
     DEFAULT_WATCHLIST: str = Field(default="AAPL,MSFT,NVDA")
+    SCAN_CONCURRENCY: int = Field(default=16)  # kiek (symbol, timeframe) vertinama lygiagrečiai
     MARKETCAP_LIMIT: int = Field(default=300_000_000)  # 300 mln USD
+    UNIVERSE_CACHE_DIR: str = Field(default="./cache")  # dienos microcap universe cache
+    PROFILE_CACHE_TTL: int = Field(default=7 * 86400)  # TD /profile cache diske (sekundėmis)
 
     # Auto-filtering (jei norėsi – galima įjungti paleidžiant)
     AUTO_FILTER_TECH: bool = Field(default=False)
+    UNIVERSE_TD_SHARE: float = Field(default=0.5)  # kiek TD limitų gali suvartoti universe skenas
     WATCHLIST_REFRESH_ON_START: bool = Field(default=False)
 
+    # Cache (sekundėmis)
+    OHLCV_CACHE_TTL_1H: int = Field(default=60)
+    OHLCV_CACHE_TTL_1D: int = Field(default=300)
+    PRICE_CACHE_TTL: int = Field(default=15)
+    PRICE_CACHE_MAXSIZE: int = Field(default=512)  # daugiausia simbolių kainų cache
+    WATCHLIST_CACHE_TTL: int = Field(default=10)
+    ETAG_CACHE_TTL: int = Field(default=3600)  # ETag/Last-Modified validatoriai + DataFrame
+    ETAG_CACHE_MAXSIZE: int = Field(default=512)
+
     # Scheduler crons
     SCHED_CRON_1H: str = Field(default="*/30 * * * *")          # kas 30 min (demo)
     SCHED_CRON_1D: str = Field(default="0 20 * * MON-FRI")      # 20:00 UTC darbo dienomis
+    SCHED_CRON_MICROCAPS: str = Field(default="0 6 * * *")    # microcap universe – kasdien 06:00 UTC
 
     model_config = SettingsConfigDict(env_file=".env", case_sensitive=True)
 
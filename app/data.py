@@ -1,50 +1,199 @@
-from typing import Optional
-import os, time
+from typing import Optional, Dict, Tuple, Any, List
+import os, time, asyncio, logging, threading
+import numpy as np
 import pandas as pd
-import requests
-from datetime import datetime, timezone
+import httpx
+import orjson
 from .config import settings
 
 _YF_ENABLE = os.getenv("YF_ENABLE_FALLBACK", "0").strip() in ("1", "true", "True", "yes")
 
-_session = requests.Session()
-_session.headers.update({
-    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36",
-    "Accept": "application/json, text/plain, */*",
-    "Connection": "keep-alive",
-})
+if _YF_ENABLE:
+    import yfinance as _yf
+    logging.getLogger("yfinance").setLevel(logging.CRITICAL)
+
+# Vienas bendras async klientas visiems tiekėjų užklausoms (keep-alive, HTTP/2).
+# Keep-alive pool'as toks pat kaip max jungčių skaičius, kad lygiagretus scan'as
+# neuždarinėtų jungčių; transportas pakartoja nepavykusius prisijungimus.
+# Jį atidaro ir uždaro FastAPI lifespan (app.state.http); be lifespan'o
+# (pvz. skriptuose) sukuriamas pirmo kvietimo metu.
+_client: Optional[httpx.AsyncClient] = None
+
+def _new_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        headers={
+            "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36",
+            "Accept": "application/json, text/plain, */*",
+            "Connection": "keep-alive",
+        },
+        timeout=20,
+        transport=httpx.AsyncHTTPTransport(
+            http2=True,
+            retries=2,
+            limits=httpx.Limits(
+                max_keepalive_connections=settings.HTTP_POOL_SIZE,
+                max_connections=settings.HTTP_POOL_SIZE,
+            ),
+        ),
+    )
+
+def http_client() -> httpx.AsyncClient:
+    """Grąžina bendrą klientą; uždarytą (po shutdown) sukuria iš naujo."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _new_client()
+    return _client
+
+_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+async def _get(url: str, params: Optional[Dict[str, Any]] = None, retries: int = 2, backoff: float = 0.3, **kwargs) -> httpx.Response:
+    """GET per bendrą klientą; laikinas klaidas (429/5xx) pakartoja su backoff."""
+    for attempt in range(retries + 1):
+        r = await http_client().get(url, params=params, **kwargs)
+        if r.status_code not in _RETRY_STATUSES or attempt == retries:
+            return r
+        await asyncio.sleep(backoff * (2 ** attempt))
 
 TD_BASE = "https://api.twelvedata.com/time_series"
+TD_PRICE = "https://api.twelvedata.com/price"
 TD_KEY = os.getenv("TWELVEDATA_API_KEY", "").strip()
 
-_td_minute_window_start = 0.0
-_td_minute_count = 0
-_td_day_window_start = 0.0
-_td_day_count = 0
+# Token bucket'ai TwelveData limitams: minutės ir dienos "kibirai" pildomi
+# tolygiai, todėl nėra šuolių ties lango riba. Kibirai bendri visam procesui –
+# juos naudoja ir universe.py (iš gijų), todėl lock'as – threading, o ne asyncio
+# (laikomas tik aritmetikos metu, event loop'o neblokuoja).
+_td_minute_tokens = float(settings.TD_MAX_PER_MINUTE)
+_td_day_tokens = float(settings.TD_MAX_PER_DAY)
+_td_last = 0.0
+_td_lock = threading.Lock()
 
 def _now() -> float:
     return time.time()
 
-def _td_allow() -> bool:
-    global _td_minute_window_start, _td_minute_count, _td_day_window_start, _td_day_count
-    t = _now()
-    if t - _td_minute_window_start >= 60:
-        _td_minute_window_start = t
-        _td_minute_count = 0
-    if t - _td_day_window_start >= 86400:
-        _td_day_window_start = t
-        _td_day_count = 0
-    if _td_minute_count < settings.TD_MAX_PER_MINUTE and _td_day_count < settings.TD_MAX_PER_DAY:
-        _td_minute_count += 1
-        _td_day_count += 1
+def td_take(cost: int, share: float = 1.0) -> float:
+    """Bando paimti `cost` žetonų. Grąžina 0, jei pavyko, kitaip – kiek sekundžių
+    reikia laukti, kol minutės kibire jų atsiras (inf, jei baigėsi dienos limitas).
+    share < 1 – caller'is gali išnaudoti tik tokią kibirų dalį (likutis paliekamas kitiems)."""
+    global _td_minute_tokens, _td_day_tokens, _td_last
+    with _td_lock:
+        t = _now()
+        minute_cap = float(settings.TD_MAX_PER_MINUTE)
+        day_cap = float(settings.TD_MAX_PER_DAY)
+        if _td_last:
+            elapsed = t - _td_last
+            _td_minute_tokens = min(minute_cap, _td_minute_tokens + elapsed * minute_cap / 60)
+            _td_day_tokens = min(day_cap, _td_day_tokens + elapsed * day_cap / 86400)
+        _td_last = t
+        minute_reserve = min((1.0 - share) * minute_cap, max(0.0, minute_cap - cost))
+        day_reserve = min((1.0 - share) * day_cap, max(0.0, day_cap - cost))
+        if _td_minute_tokens - minute_reserve >= cost and _td_day_tokens - day_reserve >= cost:
+            _td_minute_tokens -= cost
+            _td_day_tokens -= cost
+            return 0.0
+        if _td_day_tokens - day_reserve < cost or cost > minute_cap:
+            return float("inf")
+        return (cost + minute_reserve - _td_minute_tokens) * 60 / minute_cap
+
+async def _td_allow(cost: int = 1) -> bool:
+    """
+    TD limiterio vartai. Jei minutės žetonų trūksta neilgai (≤ TD_MAX_WAIT_SECONDS),
+    palaukiam ir bandom dar kartą – kad lygiagretūs caller'iai patys susireguliuotų,
+    o ne iškart kristų į Yahoo fallback'ą.
+    """
+    wait = td_take(cost)
+    if wait == 0.0:
         return True
-    return False
+    if wait > settings.TD_MAX_WAIT_SECONDS:
+        return False
+    await asyncio.sleep(wait)
+    return td_take(cost) == 0.0
+
+# TTL cache'ai: key -> (įrašymo laikas, reikšmė)
+_ohlcv_cache: Dict[Tuple[str, str], Tuple[float, pd.DataFrame]] = {}
+_price_cache: Dict[str, Tuple[float, float]] = {}
+
+_cache_purged_at: Dict[int, float] = {}
+_OHLCV_CACHE_MAX_TTL = max(settings.OHLCV_CACHE_TTL_1H, settings.OHLCV_CACHE_TTL_1D)
+
+def _cache_put(cache: Dict[Any, Tuple[float, Any]], key: Any, entry: Tuple[float, Any], ttl: float, maxsize: int = 0) -> None:
+    """
+    Įrašo reikšmę; ne dažniau nei kartą per TTL išmeta pasenusius įrašus (kad atmintis neaugtų).
+    Jei nurodytas maxsize – viršijus ribą išmetamas seniausiai įrašytas raktas.
+    """
+    now = entry[0]
+    if now - _cache_purged_at.get(id(cache), 0.0) >= ttl:
+        for k in [k for k, (ts, _) in cache.items() if now - ts >= ttl]:
+            del cache[k]
+        _cache_purged_at[id(cache)] = now
+    # Perrašomas raktas keliauja į galą, todėl dict'o pradžioje – seniausi įrašai.
+    cache.pop(key, None)
+    if maxsize and len(cache) >= maxsize:
+        del cache[next(iter(cache))]
+    cache[key] = entry
+
+def _price_put(symbol: str, ts: float, price: float) -> None:
+    _cache_put(_price_cache, symbol, (ts, price), settings.PRICE_CACHE_TTL, settings.PRICE_CACHE_MAXSIZE)
+
+# Sąlyginių užklausų cache: key -> (įrašymo laikas, (ETag, Last-Modified, DataFrame)).
+# Jei tiekėjas grąžina 304 Not Modified, naudojam jau išparsintą DataFrame.
+# Per _cache_put su TTL ir maxsize, kad keičiantis watchlist/universe neaugtų be ribų.
+_etag_cache: Dict[Tuple[str, ...], Tuple[float, Tuple[Optional[str], Optional[str], pd.DataFrame]]] = {}
+
+def _etag_hit(key: Tuple[str, ...]) -> Optional[Tuple[Optional[str], Optional[str], pd.DataFrame]]:
+    hit = _etag_cache.get(key)
+    if not hit or _now() - hit[0] >= settings.ETAG_CACHE_TTL:
+        return None
+    return hit[1]
+
+def _conditional_headers(key: Tuple[str, ...]) -> Dict[str, str]:
+    hit = _etag_hit(key)
+    if not hit:
+        return {}
+    etag, modified, _ = hit
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if modified:
+        headers["If-Modified-Since"] = modified
+    return headers
+
+def _not_modified_frame(key: Tuple[str, ...], r: httpx.Response) -> Optional[pd.DataFrame]:
+    """304 atveju – anksčiau išsaugotas DataFrame (jei dar cache'e), kitaip None."""
+    if r.status_code != 304:
+        return None
+    hit = _etag_hit(key)
+    return hit[2] if hit else None
+
+def _remember_validators(key: Tuple[str, ...], r: httpx.Response, df: pd.DataFrame) -> None:
+    etag = r.headers.get("ETag")
+    modified = r.headers.get("Last-Modified")
+    if etag or modified:
+        _cache_put(_etag_cache, key, (_now(), (etag, modified, df)),
+                   settings.ETAG_CACHE_TTL, settings.ETAG_CACHE_MAXSIZE)
+    else:
+        _etag_cache.pop(key, None)
 
 def _td_interval(tf: str) -> str:
     return {"1h": "1h", "1d": "1day"}[tf]
 
-def _download_td(symbol: str, timeframe: str, outputsize: int) -> pd.DataFrame:
-    if not TD_KEY or not _td_allow():
+def _td_outputsize(tf: str) -> int:
+    return 500 if tf == "1d" else 300
+
+def _ohlcv_ttl(tf: str) -> int:
+    return settings.OHLCV_CACHE_TTL_1H if tf == "1h" else settings.OHLCV_CACHE_TTL_1D
+
+def _td_frame(values: List[Dict[str, Any]]) -> pd.DataFrame:
+    df = pd.DataFrame(values)
+    for col in ("open","high","low","close","volume"):
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+    tcol = "datetime" if "datetime" in df.columns else "time"
+    df = df.rename(columns={tcol:"ts"})
+    df["ts"] = pd.to_datetime(df["ts"], utc=True)
+    return df[["ts","open","high","low","close","volume"]].dropna()
+
+async def _download_td(symbol: str, timeframe: str, outputsize: int) -> pd.DataFrame:
+    if not TD_KEY or not await _td_allow():
         return pd.DataFrame()
     candidates = [symbol, f"NASDAQ:{symbol}", f"NYSE:{symbol}", f"AMEX:{symbol}"]
     for sym in candidates:
@@ -56,33 +205,74 @@ def _download_td(symbol: str, timeframe: str, outputsize: int) -> pd.DataFrame:
             "outputsize": outputsize,
             "order": "ASC",
         }
+        key = ("td", sym, timeframe)
         try:
-            r = _session.get(TD_BASE, params=params, timeout=20)
+            r = await _get(TD_BASE, params=params, headers=_conditional_headers(key))
+            cached = _not_modified_frame(key, r)
+            if cached is not None:
+                return cached
             if r.status_code != 200:
                 continue
-            data = r.json()
+            data = orjson.loads(r.content)
             if "values" not in data or not data["values"]:
                 continue
-            df = pd.DataFrame(data["values"])
-            for col in ("open","high","low","close","volume"):
-                if col in df.columns:
-                    df[col] = pd.to_numeric(df[col], errors="coerce")
-            tcol = "datetime" if "datetime" in df.columns else "time"
-            df = df.rename(columns={tcol:"ts"})
-            df["ts"] = pd.to_datetime(df["ts"], utc=True)
-            return df[["ts","open","high","low","close","volume"]].dropna()
+            df = _td_frame(data["values"])
+            _remember_validators(key, r, df)
+            return df
         except Exception:
             continue
     return pd.DataFrame()
 
-def _download_yahoo_chart(symbol: str, range_: str, interval: str) -> pd.DataFrame:
+async def _download_td_batch(symbols: List[str], timeframe: str, outputsize: int) -> Dict[str, pd.DataFrame]:
+    """
+    Vienas TD /time_series kvietimas keliems simboliams (symbol=A,B,C).
+    Grąžina {symbol: DataFrame} tik tiems simboliams, kuriems gauti duomenys.
+    TD kredito kaina – po vieną simboliui, todėl limiteriui perduodam len(symbols).
+    """
+    if not TD_KEY or not symbols or not await _td_allow(len(symbols)):
+        return {}
+    params = {
+        "symbol": ",".join(symbols),
+        "interval": _td_interval(timeframe),
+        "apikey": TD_KEY,
+        "format": "JSON",
+        "outputsize": outputsize,
+        "order": "ASC",
+    }
+    try:
+        r = await _get(TD_BASE, params=params)
+        if r.status_code != 200:
+            return {}
+        data = orjson.loads(r.content)
+    except Exception:
+        return {}
+    # Vienam simboliui TD grąžina "plokščią" atsakymą, keliems – žodyną pagal simbolį.
+    if "values" in data:
+        data = {symbols[0]: data}
+    out: Dict[str, pd.DataFrame] = {}
+    for sym, payload in data.items():
+        if not isinstance(payload, dict) or not payload.get("values"):
+            continue
+        try:
+            df = _td_frame(payload["values"])
+        except Exception:
+            continue
+        if not df.empty:
+            out[sym.upper()] = df
+    return out
+
+async def _download_yahoo_chart(symbol: str, range_: str, interval: str) -> pd.DataFrame:
     url = f"https://query2.finance.yahoo.com/v8/finance/chart/{symbol}"
     params = {"range": range_, "interval": interval, "includePrePost": "false", "events": "div,splits"}
+    key = ("yahoo", symbol, range_, interval)
     try:
-        r = _session.get(url, params=params, timeout=20)
+        r = await _get(url, params=params, headers=_conditional_headers(key))
+        cached = _not_modified_frame(key, r)
+        if cached is not None:
+            return cached
         if r.status_code != 200:
             return pd.DataFrame()
-        data = r.json()
+        data = orjson.loads(r.content)
         result = (data.get("chart") or {}).get("result") or []
         if not result:
             return pd.DataFrame()
@@ -93,7 +283,7 @@ def _download_yahoo_chart(symbol: str, range_: str, interval: str) -> pd.DataFra
             return pd.DataFrame()
         q = ind[0] or {}
         df = pd.DataFrame({
-            "ts": [datetime.fromtimestamp(t, tz=timezone.utc) for t in ts],
+            "ts": pd.to_datetime(ts, unit="s", utc=True),
             "open": q.get("open"),
             "high": q.get("high"),
             "low": q.get("low"),
@@ -102,17 +292,19 @@ def _download_yahoo_chart(symbol: str, range_: str, interval: str) -> pd.DataFra
         }).dropna()
         if df.empty:
             return pd.DataFrame()
-        return df[["ts","open","high","low","close","volume"]]
+        df = df[["ts","open","high","low","close","volume"]]
+        _remember_validators(key, r, df)
+        return df
     except Exception:
         return pd.DataFrame()
 
-def _download_yf(symbol: str, period: str, interval: str) -> pd.DataFrame:
+async def _download_yf(symbol: str, period: str, interval: str) -> pd.DataFrame:
     if not _YF_ENABLE:
         return pd.DataFrame()
     try:
-        import yfinance as yf, logging
-        logging.getLogger("yfinance").setLevel(logging.CRITICAL)
-        df = yf.download(symbol, period=period, interval=interval, auto_adjust=False, progress=False, threads=False)
+        df = await asyncio.to_thread(
+            _yf.download, symbol, period=period, interval=interval, auto_adjust=False, progress=False, threads=False
+        )
         if df.empty:
             return pd.DataFrame()
         df = df.rename(columns={"Open":"open","High":"high","Low":"low","Close":"close","Volume":"volume"}).reset_index()
@@ -126,42 +318,42 @@ def _download_yf(symbol: str, period: str, interval: str) -> pd.DataFrame:
     except Exception:
         return pd.DataFrame()
 
-def fetch_ohlcv(symbol: str, timeframe: str) -> pd.DataFrame:
-    symbol = symbol.upper().strip()
-    outputsize = 500 if timeframe == "1d" else 300
-    df = _download_td(symbol, timeframe, outputsize)
+async def _download_ohlcv(symbol: str, timeframe: str) -> pd.DataFrame:
+    df = await _download_td(symbol, timeframe, _td_outputsize(timeframe))
     if not df.empty:
         return df
     if timeframe == "1h":
-        df = _download_yahoo_chart(symbol, range_="7d", interval="60m")
+        df = await _download_yahoo_chart(symbol, range_="7d", interval="60m")
         if df.empty:
-            df = _download_yahoo_chart(symbol, range_="1y", interval="1d")
+            df = await _download_yahoo_chart(symbol, range_="1y", interval="1d")
     elif timeframe == "1d":
-        df = _download_yahoo_chart(symbol, range_="1y", interval="1d")
+        df = await _download_yahoo_chart(symbol, range_="1y", interval="1d")
         if df.empty:
-            df = _download_yahoo_chart(symbol, range_="2y", interval="1d")
+            df = await _download_yahoo_chart(symbol, range_="2y", interval="1d")
     else:
         raise ValueError("Unsupported timeframe")
     if not df.empty:
         return df
     if timeframe == "1h":
-        df = _download_yf(symbol, period="7d", interval="60m")
+        df = await _download_yf(symbol, period="7d", interval="60m")
         if df.empty:
-            df = _download_yf(symbol, period="1y", interval="1d")
+            df = await _download_yf(symbol, period="1y", interval="1d")
         return df
     else:
-        return _download_yf(symbol, period="1y", interval="1d")
+        return await _download_yf(symbol, period="1y", interval="1d")
 
-def last_price(symbol: str) -> Optional[float]:
-    """Greitas paskutinės kainos gavimas per Yahoo Chart (keletas bandymų)."""
-    url = f"https://query2.finance.yahoo.com/v8/finance/chart/{symbol.upper().strip()}"
+# Kainos užklausos trumpos: greitai atsisakom neatsiliepiančio hosto ir bandom kitą intervalą.
+_PRICE_TIMEOUT = httpx.Timeout(10.0, connect=3.05)
+
+async def _download_last_price(symbol: str) -> Optional[float]:
+    url = f"https://query2.finance.yahoo.com/v8/finance/chart/{symbol}"
     tries = [("1d","1m"), ("5d","1h"), ("1y","1d")]
     for rng, itv in tries:
         try:
-            r = _session.get(url, params={"range": rng, "interval": itv, "includePrePost":"false"}, timeout=15)
+            r = await _get(url, params={"range": rng, "interval": itv, "includePrePost":"false"}, timeout=_PRICE_TIMEOUT)
             if r.status_code != 200:
                 continue
-            data = r.json()
+            data = orjson.loads(r.content)
             res = (data.get("chart") or {}).get("result") or []
             if not res: 
                 continue
@@ -169,9 +361,184 @@ def last_price(symbol: str) -> Optional[float]:
             if not q: 
                 continue
             closes = (q[0] or {}).get("close") or []
-            for val in reversed(closes):
-                if isinstance(val, (int,float)) and val == val:
-                    return float(val)
+            # Dažniausiai paskutinis baras jau turi kainą – be jokio masyvo.
+            last = closes[-1] if closes else None
+            if isinstance(last, (int, float)) and last == last:
+                return float(last)
+            # None -> NaN; paskutinė ne-NaN reikšmė randama vienu NumPy praėjimu.
+            arr = np.asarray(closes, dtype=np.float64)
+            mask = ~np.isnan(arr)
+            if mask.any():
+                return float(arr[mask][-1])
         except Exception:
             continue
     return None
+
+YAHOO_QUOTE = "https://query1.finance.yahoo.com/v7/finance/quote"
+_YAHOO_QUOTE_BATCH = 50
+
+async def _download_yahoo_quotes(symbols: List[str]) -> Dict[str, float]:
+    """Paskutinės kainos keliems simboliams vienu Yahoo /v7/finance/quote kvietimu."""
+    try:
+        r = await _get(YAHOO_QUOTE, params={"symbols": ",".join(symbols)}, timeout=_PRICE_TIMEOUT)
+        if r.status_code != 200:
+            return {}
+        res = ((orjson.loads(r.content).get("quoteResponse") or {}).get("result")) or []
+    except Exception:
+        return {}
+    out: Dict[str, float] = {}
+    for q in res:
+        try:
+            out[q["symbol"].upper()] = float(q["regularMarketPrice"])
+        except Exception:
+            continue
+    return out
+
+_OHLCV_COLS = ["open", "high", "low", "close", "volume"]
+
+def _float_ohlcv(df: pd.DataFrame) -> pd.DataFrame:
+    """Suvienodina OHLCV stulpelius į float64 (tiekėjai grąžina ir int), kad
+    vartotojai galėtų imti df["close"].to_numpy() be kopijos."""
+    if (df.dtypes[_OHLCV_COLS] == np.float64).all():
+        return df
+    out = df.copy()
+    out[_OHLCV_COLS] = out[_OHLCV_COLS].astype(np.float64)
+    return out
+
+def cached_ohlcv(symbol: str, timeframe: str) -> Optional[pd.DataFrame]:
+    """Šviežias OHLCV iš cache (be tinklo), arba None."""
+    hit = _ohlcv_cache.get((symbol.upper().strip(), timeframe))
+    if hit and _now() - hit[0] < _ohlcv_ttl(timeframe):
+        return hit[1]
+    return None
+
+async def fetch_ohlcv(symbol: str, timeframe: str) -> pd.DataFrame:
+    """OHLCV su trumpu TTL cache pagal (symbol, timeframe) – tas pats baras
+    per TTL nekinta, tad nekartojam HTTP užklausų ir netaupom TD limitų veltui."""
+    symbol = symbol.upper().strip()
+    key = (symbol, timeframe)
+    now = _now()
+    hit = _ohlcv_cache.get(key)
+    if hit and now - hit[0] < _ohlcv_ttl(timeframe):
+        return hit[1]
+    df = await _download_ohlcv(symbol, timeframe)
+    if not df.empty:
+        df = _float_ohlcv(df)
+        _cache_put(_ohlcv_cache, key, (now, df), _OHLCV_CACHE_MAX_TTL)
+    return df
+
+async def prefetch_ohlcv(symbols: List[str], timeframe: str) -> int:
+    """
+    Užpildo OHLCV cache TD batch kvietimais (po TD_BATCH_SIZE simbolių), kad
+    vėlesni fetch_ohlcv() tam pačiam simboliui neitų į tinklą.
+    Simboliai, kurių TD negrąžino (ar pritrūko limito), vėliau parsiunčiami po vieną.
+    Grąžina, kiek simbolių įdėta į cache.
+    """
+    if not TD_KEY:
+        return 0
+    now = _now()
+    ttl = _ohlcv_ttl(timeframe)
+    todo = []
+    for s in dict.fromkeys(s.upper().strip() for s in symbols):
+        hit = _ohlcv_cache.get((s, timeframe))
+        if not (hit and now - hit[0] < ttl):
+            todo.append(s)
+    # Batch negali būti didesnis už minutės limitą – kitaip jo niekada neleistų.
+    size = max(1, min(settings.TD_BATCH_SIZE, settings.TD_MAX_PER_MINUTE))
+    filled = 0
+    for i in range(0, len(todo), size):
+        frames = await _download_td_batch(todo[i:i + size], timeframe, _td_outputsize(timeframe))
+        if not frames:
+            break
+        t = _now()
+        for sym, df in frames.items():
+            _cache_put(_ohlcv_cache, (sym, timeframe), (t, _float_ohlcv(df)), _OHLCV_CACHE_MAX_TTL)
+            filled += 1
+    return filled
+
+async def last_price(symbol: str) -> Optional[float]:
+    """Greitas paskutinės kainos gavimas per Yahoo Chart (keletas bandymų), su TTL cache."""
+    symbol = symbol.upper().strip()
+    now = _now()
+    hit = _price_cache.get(symbol)
+    if hit and now - hit[0] < settings.PRICE_CACHE_TTL:
+        return hit[1]
+    price = await _download_last_price(symbol)
+    if price is not None:
+        _price_put(symbol, now, price)
+    return price
+
+async def last_prices(symbols: List[str]) -> Dict[str, float]:
+    """
+    Kelių simbolių kainos: vienas TD /price kvietimas (symbol=A,B,C) kiekvienam
+    batch'ui; ko TD negrąžino – Yahoo /v7/finance/quote batch'ais, o likusius –
+    lygiagrečiai per Yahoo Chart (kaip last_price()).
+    Naudoja tą patį TTL cache. Grąžina {SYMBOL: kaina} tik rastoms kainoms.
+    """
+    now = _now()
+    out: Dict[str, float] = {}
+    todo: List[str] = []
+    for s in dict.fromkeys(s.upper().strip() for s in symbols):
+        hit = _price_cache.get(s)
+        if hit and now - hit[0] < settings.PRICE_CACHE_TTL:
+            out[s] = hit[1]
+        else:
+            todo.append(s)
+    if not todo:
+        return out
+    if TD_KEY:
+        size = max(1, min(settings.TD_BATCH_SIZE, settings.TD_MAX_PER_MINUTE))
+        for i in range(0, len(todo), size):
+            chunk = todo[i:i + size]
+            if not await _td_allow(len(chunk)):
+                break
+            try:
+                r = await _get(TD_PRICE, params={"symbol": ",".join(chunk), "apikey": TD_KEY})
+                if r.status_code != 200:
+                    continue
+                data = orjson.loads(r.content)
+            except Exception:
+                continue
+            # Vienam simboliui TD grąžina {"price": ...}, keliems – {SYM: {"price": ...}}.
+            if "price" in data:
+                data = {chunk[0]: data}
+            t = _now()
+            for sym, v in data.items():
+                try:
+                    price = float(v["price"])
+                except Exception:
+                    continue
+                sym = sym.upper()
+                out[sym] = price
+                _price_put(sym, t, price)
+
+    # Likučiai – Yahoo v7 quote batch'ais, o ko ir ten nėra – per chart po vieną.
+    missing = [s for s in todo if s not in out]
+    if missing:
+        t = _now()
+        for i in range(0, len(missing), _YAHOO_QUOTE_BATCH):
+            for sym, price in (await _download_yahoo_quotes(missing[i:i + _YAHOO_QUOTE_BATCH])).items():
+                out[sym] = price
+                _price_put(sym, t, price)
+        missing = [s for s in missing if s not in out]
+    if missing:
+        sem = asyncio.Semaphore(settings.SCAN_CONCURRENCY)
+
+        async def one(sym: str) -> Optional[float]:
+            async with sem:
+                return await _download_last_price(sym)
+
+        t = _now()
+        for sym, price in zip(missing, await asyncio.gather(*(one(s) for s in missing), return_exceptions=True)):
+            if price is None or isinstance(price, BaseException):
+                continue
+            out[sym] = price
+            _price_put(sym, t, price)
+    return out
+
+async def close_http_client() -> None:
+    """Uždaro bendrą HTTP klientą (kviečiama iš FastAPI lifespan)."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -2,7 +2,23 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 from .config import settings
 
-engine = create_engine(settings.DATABASE_URL, connect_args={})
+def _engine_kwargs(url: str) -> dict:
+    """Pool nustatymai serveriniam DB; sqlite paliekam SQLAlchemy numatytuosius."""
+    if url.startswith("sqlite"):
+        return {}
+    return {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_pre_ping": True,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+    }
+
+engine = create_engine(
+    settings.DATABASE_URL,
+    connect_args={},
+    query_cache_size=settings.DB_QUERY_CACHE_SIZE,
+    **_engine_kwargs(settings.DATABASE_URL),
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -1,121 +1,254 @@
 from __future__ import annotations
 
 from contextlib import asynccontextmanager
-from datetime import datetime
 from typing import Optional, List
 import asyncio
+import math
+import re
+import time
 
+import numpy as np
+import pandas as pd
 from fastapi import FastAPI, Depends, Header, HTTPException, Query
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel, field_validator
 from sqlalchemy.orm import Session
-from sqlalchemy import text
+from sqlalchemy import text, select, func, insert, update, delete, lambda_stmt
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 
 from .config import settings
 from .db import Base, engine, get_db, SessionLocal
-from .models import Signal, Watchlist, Position, PositionStatus
+from .models import Signal, Watchlist, Position, PositionStatus, MicrocapUniverse
 from .schemas import SignalOut, PositionOut, WatchlistOut, PortfolioRow
 from .signal_engine import compute_entry, compute_exit
 from .notifier import notify_signal
 from .telegram_bot import bot_instance
-from .universe import fetch_tech_microcaps
-from .data import fetch_ohlcv, last_price
+from .universe import (
+    fetch_tech_microcaps, UniverseScanIncomplete, refresh_guard,
+    resume_refreshes, stop_refreshes, close_session as close_universe_session,
+)
+from .data import fetch_ohlcv, prefetch_ohlcv, cached_ohlcv, last_prices, http_client, close_http_client
 
 
 # --- Helperiai / bendros reikmės -------------------------------------------------
 
 timeframes = [t.strip() for t in settings.DEFAULT_TIMEFRAMES.split(",") if t.strip()]
+_DEFAULT_WATCHLIST = tuple(s.strip().upper() for s in settings.DEFAULT_WATCHLIST.split(",") if s.strip())
+
+# Trumpas watchlist cache UI poll'ams ir scan'ui; išvalomas po kiekvieno rašymo
+# per API. Telegram /add ir /remove pakeitimai matomi po WATCHLIST_CACHE_TTL.
+_wl_cache = {"at": 0.0, "rows": None}
+
+def _watchlist_rows(db: Session) -> List[dict]:
+    now = time.monotonic()
+    if _wl_cache["rows"] is not None and now - _wl_cache["at"] < settings.WATCHLIST_CACHE_TTL:
+        return _wl_cache["rows"]
+    # Tik reikalingi stulpeliai – be ORM objektų hidratavimo.
+    rows = [
+        dict(r)
+        for r in db.execute(select(Watchlist.id, Watchlist.symbol).order_by(Watchlist.symbol.asc())).mappings()
+    ]
+    _wl_cache.update(at=now, rows=rows)
+    return rows
+
+def _invalidate_watchlist_cache():
+    _wl_cache["rows"] = None
 
 def get_watchlist_symbols(db: Session) -> List[str]:
-    rows = db.query(Watchlist).order_by(Watchlist.symbol.asc()).all()
-    return [r.symbol for r in rows]
+    return [r["symbol"] for r in _watchlist_rows(db)]
 
 def seed_watchlist_if_empty(db: Session):
-    if db.query(Watchlist).count() == 0:
-        defaults = [s.strip().upper() for s in settings.DEFAULT_WATCHLIST.split(",") if s.strip()]
-        for s in defaults:
-            db.add(Watchlist(symbol=s))
+    # Užtenka patikrinti, ar yra bent viena eilutė (be COUNT(*) per visą lentelę).
+    if db.execute(select(Watchlist.id).limit(1)).first() is None:
+        if _DEFAULT_WATCHLIST:
+            db.execute(insert(Watchlist), [{"symbol": s} for s in _DEFAULT_WATCHLIST])
+        db.commit()
+        _invalidate_watchlist_cache()
+
+def store_microcap_universe(db: Session, cap_limit: int, force: bool = False) -> List[str]:
+    """
+    Perskenuoja microcap universe per TwelveData (stocks + profile) ir perrašo
+    microcap_universe lentelę (su cap_limit). Tuščio ar nepilno skeno (UniverseScanIncomplete,
+    pvz. pritrūko TD limitų) nerašom – lieka ankstesnis universe.
+    """
+    syms = fetch_tech_microcaps(limit_cap=cap_limit, force=force)
+    if not syms:
+        return []
+    try:
+        db.execute(delete(MicrocapUniverse))
+        db.execute(insert(MicrocapUniverse), [{"symbol": s, "cap_limit": int(cap_limit)} for s in syms])
         db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return syms
 
-def refresh_watchlist_from_twelvedata(db: Session, cap_limit: int) -> int:
+def refresh_watchlist_from_twelvedata(db: Session, cap_limit: int, force: bool = False) -> int:
     """
     Užpildo watchlist visomis JAV technologijų įmonėmis, kurių market cap < cap_limit.
-    Duomenys imami iš TwelveData (stocks + profile). PERRAŠO esamą sąrašą.
+    Simboliai imami iš microcap_universe lentelės (pildo dienos job'as), jei ji skenuota
+    tuo pačiu cap_limit; kitaip (ar force=True) – skenuojama TwelveData (stocks + profile).
+    PERRAŠO esamą sąrašą.
     """
-    syms = fetch_tech_microcaps(limit_cap=cap_limit)
+    syms: List[str] = []
+    if not force:
+        syms = list(db.execute(
+            select(MicrocapUniverse.symbol)
+            .where(MicrocapUniverse.cap_limit == int(cap_limit))
+            .order_by(MicrocapUniverse.id)
+        ).scalars())
+    if not syms:
+        syms = store_microcap_universe(db, cap_limit, force)
     if not syms:
         return 0
-    db.query(Watchlist).delete()
-    for s in syms:
-        db.add(Watchlist(symbol=s))
-    db.commit()
+    # DELETE + multi-row INSERT vienoje transakcijoje: klaidos atveju lieka senas sąrašas.
+    try:
+        db.execute(delete(Watchlist))
+        db.execute(insert(Watchlist), [{"symbol": s} for s in syms])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    _invalidate_watchlist_cache()
     return len(syms)
 
+def _refresh_watchlist_job(cap_limit: int, force: bool = False) -> int:
+    """refresh_watchlist_from_twelvedata su nuosava sesija (blokuojantis – kviesti ne iš event loop'o)."""
+    with refresh_guard():
+        db = SessionLocal()
+        try:
+            return refresh_watchlist_from_twelvedata(db, cap_limit, force)
+        finally:
+            db.close()
+
 
 # --- SCAN logika (apibrėžta PRIEŠ scheduler’į!) ---------------------------------
 
+# Riboja vienu metu vykdomų (symbol, timeframe) vertinimų skaičių.
+# TD tempą atskirai prižiūri data._td_allow, todėl čia – tik lygiagretumo riba.
+_scan_sem = asyncio.Semaphore(settings.SCAN_CONCURRENCY)
+
+async def _bounded(coro):
+    async with _scan_sem:
+        return await coro
+
+# Telegram pranešimai siunčiami fone, kad scan'as nelauktų Telegram API.
+# Eilę ir worker'į sukuria lifespan; be jo (pvz. skriptuose) siunčiama iškart.
+_notify_q: Optional[asyncio.Queue] = None
+
+async def _notify_worker(q: asyncio.Queue):
+    while True:
+        payload = await q.get()
+        try:
+            await notify_signal(payload)
+        except Exception:
+            pass
+        finally:
+            q.task_done()
+
 async def run_scan(db: Session) -> int:
     """
     Peržiūri watchlist simbolius ir timeframe'us.
     - Jei yra atvira pozicija → tikrina EXIT signalą (SELL).
     - Jei nėra atviros pozicijos → ieško ENTRY signalo (BUY) ir atidaro poziciją.
-    Sukurtus signalus siunčia į Telegram per notify_signal().
+    Duomenys visoms poroms parsiunčiami lygiagrečiai (ribojama _scan_sem),
+    o visi DB pakeitimai įrašomi vienu commit'u po to.
+    Sukurtus signalus perduoda Telegram pranešimų eilei (_notify_q).
     """
-    created = 0
     wls = get_watchlist_symbols(db)
+    # TD batch kvietimai užpildo OHLCV cache; likusius compute_* parsisiųs po vieną.
+    for tf in timeframes:
+        try:
+            await prefetch_ohlcv(wls, tf)
+        except Exception:
+            pass
+    # Visos atviros pozicijos viena užklausa; rikiuojam nuo seniausios, kad
+    # dict'e liktų naujausia kiekvienai (symbol, timeframe) porai.
+    open_map = {
+        (p.symbol, p.timeframe): p
+        for p in db.query(Position)
+        .filter_by(status=PositionStatus.OPEN)
+        .order_by(Position.opened_at.asc(), Position.id.asc())
+        .all()
+    }
+    jobs = []
     for sym in wls:
         for tf in timeframes:
-            # EXIT patikra (jei yra atvira pozicija)
-            pos = (
-                db.query(Position)
-                .filter_by(symbol=sym, timeframe=tf, status=PositionStatus.OPEN)
-                .order_by(Position.opened_at.desc())
-                .first()
-            )
+            pos = open_map.get((sym, tf))
+            # Prefetch'o užpildytas kainas perduodam tiesiai; kitiems compute_* parsisiųs pats.
+            df = cached_ohlcv(sym, tf)
+            closes = df["close"].to_numpy(dtype=np.float64, copy=False) if df is not None else None
             if pos:
-                try:
-                    exit_sig = compute_exit(sym, tf, pos.entry, pos.stop, pos.tp1, pos.tp2)
-                except Exception:
-                    exit_sig = None
-                if exit_sig:
-                    row = Signal(**{k: v for k, v in exit_sig.items() if k != "is_exit"})
-                    db.add(row)
-                    pos.status = PositionStatus.CLOSED
-                    pos.closed_at = datetime.utcnow()
-                    db.commit()
-                    db.refresh(row)
-                    created += 1
-                    payload = SignalOut.model_validate(row).model_dump()
-                    payload["notes"] = "EXIT"
-                    await notify_signal(payload)
-                continue
-
-            # ENTRY paieška (jei nėra atviros pozicijos)
-            try:
-                entry_sig = compute_entry(sym, tf)
-            except Exception:
-                entry_sig = None
-            if entry_sig:
-                row = Signal(**entry_sig)
-                db.add(row)
-                db.commit()
-                db.refresh(row)
-                created += 1
-                db.add(
-                    Position(
-                        symbol=sym,
-                        timeframe=tf,
-                        entry=entry_sig["entry"],
-                        stop=entry_sig["stop"],
-                        tp1=entry_sig["tp1"],
-                        tp2=entry_sig["tp2"],
-                    )
-                )
-                db.commit()
-                await notify_signal(SignalOut.model_validate(row).model_dump())
-    return created
+                # EXIT patikra (jei yra atvira pozicija)
+                coro = compute_exit(sym, tf, pos.entry, pos.stop, pos.tp1, pos.tp2, closes=closes)
+            else:
+                # ENTRY paieška (jei nėra atviros pozicijos)
+                coro = compute_entry(sym, tf, closes=closes)
+            jobs.append((sym, tf, pos, _bounded(coro)))
+
+    results = await asyncio.gather(*(j[3] for j in jobs), return_exceptions=True)
+
+    # Visi pakeitimai įrašomi Core batch'ais vienoje transakcijoje.
+    new_signals, exit_flags, new_positions, closed_ids = [], [], [], []
+    for (sym, tf, pos, _), sig in zip(jobs, results):
+        if isinstance(sig, BaseException) or not sig:
+            continue
+        new_signals.append({k: v for k, v in sig.items() if k != "is_exit"})
+        exit_flags.append(bool(pos))
+        if pos:
+            # EXIT: signalas + pozicijos uždarymas
+            closed_ids.append(pos.id)
+        else:
+            # ENTRY: signalas + nauja pozicija
+            new_positions.append(
+                {
+                    "symbol": sym,
+                    "timeframe": tf,
+                    "entry": sig["entry"],
+                    "stop": sig["stop"],
+                    "tp1": sig["tp1"],
+                    "tp2": sig["tp2"],
+                }
+            )
+    if not new_signals:
+        return 0
+    try:
+        # RETURNING grąžina id/created_at tuo pačiu INSERT'u (be refresh užklausų).
+        returned = db.execute(
+            insert(Signal).returning(Signal.id, Signal.created_at, sort_by_parameter_order=True),
+            new_signals,
+        ).all()
+        if new_positions:
+            db.execute(insert(Position), new_positions)
+        if closed_ids:
+            # closed_at užpildo DB – vienodas laikas visam batch'ui.
+            db.execute(
+                update(Position)
+                .where(Position.id.in_(closed_ids))
+                .values(status=PositionStatus.CLOSED, closed_at=func.now()),
+                execution_options={"synchronize_session": False},
+            )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    # Pranešimo payload'as – iš jau turimų laukų, be ORM -> Pydantic validacijos.
+    payloads = []
+    for fields, is_exit, (sig_id, created_at) in zip(new_signals, exit_flags, returned):
+        payload = {**fields, "id": sig_id, "created_at": created_at}
+        if is_exit:
+            payload["notes"] = "EXIT"
+        payloads.append(payload)
+    if _notify_q is not None:
+        for p in payloads:
+            _notify_q.put_nowait(p)
+    else:
+        await asyncio.gather(*(notify_signal(p) for p in payloads), return_exceptions=True)
+    return len(new_signals)
 
 async def job_scan_1h():
     db = SessionLocal()
@@ -131,25 +264,69 @@ async def job_scan_1d():
     finally:
         db.close()
 
+def _refresh_microcaps_sync():
+    with refresh_guard():
+        db = SessionLocal()
+        try:
+            store_microcap_universe(db, settings.MARKETCAP_LIMIT)
+            refresh_watchlist_from_twelvedata(db, settings.MARKETCAP_LIMIT)
+        finally:
+            db.close()
+
+async def job_refresh_microcaps():
+    """Dienos microcap universe atnaujinimas fone (tūkstančiai TD kvietimų – ne užklausos metu)."""
+    try:
+        await run_in_threadpool(_refresh_microcaps_sync)
+    except Exception:
+        pass
+
 
 # --- Lifespan (DB create_all, seed, scheduler, telegram bot) ---------------------
 
+# Indeksai, kurių modeliai nebeturi; create_all jų neištrina, todėl – rankiniu DROP.
+# ix_positions_symbol: dengia ix_positions_sym_tf_status_opened (symbol – pirmas stulpelis).
+_OBSOLETE_INDEXES = ("ix_positions_symbol",)
+
+def _drop_obsolete_indexes():
+    for name in _OBSOLETE_INDEXES:
+        try:
+            with engine.begin() as conn:
+                conn.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
+        except Exception:
+            pass
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # DB schema
     Base.metadata.create_all(bind=engine)
+    _drop_obsolete_indexes()
 
     # Seed'inam watchlist, jei tuščia
     _db = SessionLocal()
     try:
         seed_watchlist_if_empty(_db)
-        if settings.WATCHLIST_REFRESH_ON_START and settings.AUTO_FILTER_TECH and settings.TWELVEDATA_API_KEY:
+    finally:
+        _db.close()
+
+    # Microcap universe atnaujinimas – blokuojantis (/stocks + /profile per gijų pool'ą),
+    # todėl leidžiam jį fone per threadpool'ą: startup, botas ir scheduler'is nelaukia.
+    resume_refreshes()
+    app.state.refresh_task = None
+    if settings.WATCHLIST_REFRESH_ON_START and settings.AUTO_FILTER_TECH and settings.TWELVEDATA_API_KEY:
+        async def _refresh_universe():
             try:
-                refresh_watchlist_from_twelvedata(_db, settings.MARKETCAP_LIMIT)
+                await run_in_threadpool(_refresh_watchlist_job, settings.MARKETCAP_LIMIT)
             except Exception:
                 pass
-    finally:
-        _db.close()
+        app.state.refresh_task = asyncio.create_task(_refresh_universe())
+
+    # Bendras HTTP klientas tiekėjų užklausoms (keep-alive tarp scan'ų)
+    app.state.http = http_client()
+
+    # Telegram pranešimų eilė + worker'is
+    global _notify_q
+    _notify_q = app.state.notify_q = asyncio.Queue()
+    app.state.notify_task = asyncio.create_task(_notify_worker(_notify_q))
 
     # Scheduler
     app.state.scheduler = None
@@ -158,6 +335,9 @@ async def lifespan(app: FastAPI):
         # ✔ čia vardai jau apibrėžti aukščiau
         sched.add_job(job_scan_1h, CronTrigger.from_crontab(settings.SCHED_CRON_1H))
         sched.add_job(job_scan_1d, CronTrigger.from_crontab(settings.SCHED_CRON_1D))
+        # Universe reikalingas tik auto-filtrui – kitaip tūkstančiai TD kvietimų būtų veltui.
+        if settings.AUTO_FILTER_TECH and settings.TWELVEDATA_API_KEY:
+            sched.add_job(job_refresh_microcaps, CronTrigger.from_crontab(settings.SCHED_CRON_MICROCAPS))
         sched.start()
         app.state.scheduler = sched
 
@@ -176,6 +356,14 @@ async def lifespan(app: FastAPI):
     try:
         yield
     finally:
+        # Išsiunčiam eilėje likusius pranešimus (kol botas dar veikia)
+        try:
+            await asyncio.wait_for(app.state.notify_q.join(), timeout=settings.SHUTDOWN_TIMEOUT_SECONDS)
+        except Exception:
+            pass
+        app.state.notify_task.cancel()
+        _notify_q = None
+
         # Tel. bot shutdown
         if settings.ENABLE_TELEGRAM and app.state.bot_task:
             try:
@@ -188,6 +376,12 @@ async def lifespan(app: FastAPI):
             except Exception:
                 pass
 
+        # Universe atnaujinimai vyksta gijose (startup task, scheduler job, admin) – task'o
+        # cancel jų nesustabdo. Prašom sustoti ir laukiam; requests sesiją uždarom tik jei baigė.
+        universe_idle = await run_in_threadpool(stop_refreshes, settings.SHUTDOWN_TIMEOUT_SECONDS)
+        if app.state.refresh_task:
+            app.state.refresh_task.cancel()
+
         # Scheduler shutdown
         if settings.ENABLE_SCHEDULER and app.state.scheduler:
             try:
@@ -195,10 +389,20 @@ async def lifespan(app: FastAPI):
             except Exception:
                 pass
 
+        # Bendri HTTP klientai
+        try:
+            await close_http_client()
+        except Exception:
+            pass
+        if universe_idle:
+            close_universe_session()
+
 
 # --- FastAPI app ----------------------------------------------------------------
 
-app = FastAPI(title=settings.APP_NAME, lifespan=lifespan)
+app = FastAPI(title=settings.APP_NAME, lifespan=lifespan, default_response_class=ORJSONResponse)
+# Suspaudžiam HTML ir didesnius JSON atsakymus (pvz. /api/ohlcv).
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
 
 @app.get("/health")
 def health():
@@ -214,27 +418,31 @@ def list_signals(
     timeframe: str | None = None,
     db: Session = Depends(get_db),
 ):
-    q = db.query(Signal).order_by(Signal.created_at.desc())
+    # lambda_stmt: sukompiliuotas SQL cache'inamas tarp užklausų (kintamieji – bind parametrai).
+    stmt = lambda_stmt(lambda: select(Signal))
     if symbol:
-        q = q.filter(Signal.symbol == symbol.upper())
+        sym = symbol.upper()
+        stmt += lambda s: s.where(Signal.symbol == sym)
     if timeframe:
-        q = q.filter(Signal.timeframe == timeframe)
-    return q.limit(limit).all()
+        stmt += lambda s: s.where(Signal.timeframe == timeframe)
+    stmt += lambda s: s.order_by(Signal.created_at.desc()).limit(limit)
+    return db.execute(stmt).scalars().all()
 
 @app.get("/api/positions", response_model=list[PositionOut])
 def list_positions(status: str = "OPEN", db: Session = Depends(get_db)):
     if status not in ("OPEN", "CLOSED"):
         status = "OPEN"
-    return (
-        db.query(Position)
-        .filter_by(status=status)
+    # Tik PositionOut stulpeliai kaip eilutės – be ORM objektų ir identity map.
+    stmt = (
+        select(*(getattr(Position, f) for f in PositionOut.model_fields))
+        .where(Position.status == status)
         .order_by(Position.opened_at.desc())
-        .all()
     )
+    return db.execute(stmt).mappings().all()
 
 @app.get("/api/watchlist", response_model=list[WatchlistOut])
 def list_watchlist(db: Session = Depends(get_db)):
-    return db.query(Watchlist).order_by(Watchlist.symbol.asc()).all()
+    return _watchlist_rows(db)
 
 class WatchlistIn(BaseModel):
     symbol: str
@@ -261,6 +469,7 @@ def add_watchlist(
     db.add(row)
     db.commit()
     db.refresh(row)
+    _invalidate_watchlist_cache()
     return row
 
 @app.delete("/api/watchlist/{symbol}")
@@ -277,37 +486,53 @@ def delete_watchlist(
         return {"deleted": 0}
     db.delete(row)
     db.commit()
+    _invalidate_watchlist_cache()
     return {"deleted": 1}
 
 @app.get("/api/ohlcv")
-def api_ohlcv(symbol: str = Query(...), timeframe: str = Query("1d"), limit: int = 300):
-    df = fetch_ohlcv(symbol.upper(), timeframe)
+async def api_ohlcv(symbol: str = Query(...), timeframe: str = Query("1d"), limit: int = 300):
+    df = await fetch_ohlcv(symbol.upper(), timeframe)
     if df.empty:
-        return JSONResponse({"symbol": symbol.upper(), "timeframe": timeframe, "bars": []})
+        return ORJSONResponse({"symbol": symbol.upper(), "timeframe": timeframe, "bars": []})
     df = df.tail(limit)
+    # Vektorizuotas konvertavimas (be iterrows): laikas sekundėmis + OHLCV kaip Python float'ai.
+    ts = pd.to_datetime(df["ts"], utc=True).astype("datetime64[ns, UTC]")
+    times = (ts.astype("int64") // 10**9).tolist()
+    ohlcv = df[["open", "high", "low", "close", "volume"]].to_numpy(dtype=float).tolist()
     bars = [
-        {
-            "time": int(row["ts"].timestamp()),
-            "open": float(row["open"]),
-            "high": float(row["high"]),
-            "low": float(row["low"]),
-            "close": float(row["close"]),
-            "volume": float(row.get("volume", 0.0)),
-        }
-        for _, row in df.iterrows()
+        {"time": t, "open": o, "high": h, "low": l, "close": c, "volume": v}
+        for t, (o, h, l, c, v) in zip(times, ohlcv)
     ]
-    return {"symbol": symbol.upper(), "timeframe": timeframe, "bars": bars}
+    # Tiesiai ORJSONResponse – praleidžiam jsonable_encoder perėjimą per kiekvieną barą.
+    return ORJSONResponse({"symbol": symbol.upper(), "timeframe": timeframe, "bars": bars})
 
 @app.get("/api/portfolio", response_model=list[PortfolioRow])
-def api_portfolio(db: Session = Depends(get_db)):
-    rows = db.query(Position).filter_by(status=PositionStatus.OPEN).all()
-    out: list[PortfolioRow] = []
-    for r in rows:
-        lp = last_price(r.symbol)
-        ch = ((lp - r.entry) / r.entry) if (lp and r.entry) else None
-        rr = ((r.tp1 - r.entry) / (r.entry - r.stop)) if r.entry > r.stop else None
-        out.append(PortfolioRow(symbol=r.symbol, timeframe=r.timeframe, entry=float(r.entry), last=(float(lp) if lp else None), change_pct=(float(ch) if ch is not None else None), rr=(float(rr) if rr is not None else None)))
-    return out
+async def api_portfolio(db: Session = Depends(get_db)):
+    # Sinchroninis DB skaitymas – threadpool'e, kad neblokuotų event loop'o.
+    rows = await run_in_threadpool(lambda: db.query(Position).filter_by(status=PositionStatus.OPEN).all())
+    if not rows:
+        return []
+    # Visos kainos vienu batch kvietimu (TD /price, likučiai – Yahoo).
+    prices = await last_prices([r.symbol for r in rows])
+    # P/L ir R:R skaičiuojam visiems iš karto NumPy masyvais; NaN -> None.
+    entries = np.array([r.entry for r in rows], dtype=float)
+    stops = np.array([r.stop for r in rows], dtype=float)
+    tp1s = np.array([r.tp1 for r in rows], dtype=float)
+    lasts = np.array([prices.get(r.symbol) or np.nan for r in rows], dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        chg = np.where(~np.isnan(lasts) & (entries != 0), (lasts - entries) / entries, np.nan)
+        rr = np.where(entries > stops, (tp1s - entries) / (entries - stops), np.nan)
+    return [
+        PortfolioRow(
+            symbol=r.symbol,
+            timeframe=r.timeframe,
+            entry=e,
+            last=(None if math.isnan(lp) else lp),
+            change_pct=(None if math.isnan(c) else c),
+            rr=(None if math.isnan(x) else x),
+        )
+        for r, e, lp, c, x in zip(rows, entries.tolist(), lasts.tolist(), chg.tolist(), rr.tolist())
+    ]
 
 
 # --- ADMIN endpoint’ai -----------------------------------------------------------
@@ -324,21 +549,21 @@ async def admin_scan_now(x_admin_token: str = Header(default="")):
         db.close()
 
 @app.post("/admin/refresh_microcaps")
-def admin_refresh_microcaps(x_admin_token: str = Header(default="")):
+def admin_refresh_microcaps(force: bool = False, x_admin_token: str = Header(default="")):
     """
     Perrašo watchlist visomis US Technology įmonėmis su market cap < settings.MARKETCAP_LIMIT.
-    Reikia TWELVEDATA_API_KEY.
+    Simboliai – iš microcap_universe lentelės (dienos job'as); ?force=true – perskenuoja
+    TwelveData ignoruodamas cache. Reikia TWELVEDATA_API_KEY.
     """
     if x_admin_token != settings.ADMIN_TOKEN:
         raise HTTPException(status_code=401, detail="Unauthorized")
     if not settings.TWELVEDATA_API_KEY:
         raise HTTPException(status_code=400, detail="TWELVEDATA_API_KEY is not set")
-    db = SessionLocal()
     try:
-        n = refresh_watchlist_from_twelvedata(db, settings.MARKETCAP_LIMIT)
-        return {"updated": n}
-    finally:
-        db.close()
+        return {"updated": _refresh_watchlist_job(settings.MARKETCAP_LIMIT, force)}
+    except UniverseScanIncomplete as e:
+        # watchlist ir universe lieka nepakeisti
+        raise HTTPException(status_code=503, detail=str(e))
 
 @app.post("/admin/reset_db")
 def admin_reset_db(x_admin_token: str = Header(default="")):
@@ -352,6 +577,7 @@ def admin_reset_db(x_admin_token: str = Header(default="")):
         conn.exec_driver_sql("DROP TABLE IF EXISTS positions CASCADE;")
         conn.exec_driver_sql("DROP TABLE IF EXISTS signals CASCADE;")
         conn.exec_driver_sql("DROP TABLE IF EXISTS watchlist CASCADE;")
+        conn.exec_driver_sql("DROP TABLE IF EXISTS microcap_universe CASCADE;")
         # optional: enum tipų drop, jei buvo sukūrę:
         try:
             conn.exec_driver_sql("DROP TYPE IF EXISTS signalstatus CASCADE;")
@@ -362,16 +588,20 @@ def admin_reset_db(x_admin_token: str = Header(default="")):
         except Exception:
             pass
     Base.metadata.create_all(bind=engine)
+    _invalidate_watchlist_cache()
     return {"reset": True}
 
 
 # --- UI (grafinė sąsaja su grafiku ir t.t.) -------------------------------------
 
-@app.get("/", response_class=HTMLResponse)
-def index():
-    options = "".join([f'<option value="{tf}">{tf}</option>' for tf in timeframes])
-    app_name = settings.APP_NAME
-    tfs = ", ".join(timeframes)
+_PLACEHOLDER_RE = re.compile(r"\[\[(\w+)\]\]")
+
+def _build_index_html() -> str:
+    values = {
+        "APP_NAME": settings.APP_NAME,
+        "TFS": ", ".join(timeframes),
+        "OPTIONS": "".join(f'<option value="{tf}">{tf}</option>' for tf in timeframes),
+    }
 
     html = """
 <!doctype html>
@@ -673,9 +903,12 @@ def index():
 </body>
 </html>
 """
-    html = (
-        html.replace("[[APP_NAME]]", app_name)
-        .replace("[[TFS]]", tfs)
-        .replace("[[OPTIONS]]", options)
-    )
-    return HTMLResponse(content=html)
+    # Visi [[VARDAS]] pakeičiami vienu praėjimu (JS {} / ${} lieka nepaliesti).
+    return _PLACEHOLDER_RE.sub(lambda m: values[m.group(1)], html)
+
+# Puslapis priklauso tik nuo settings/timeframes, todėl sugeneruojam vieną kartą.
+_INDEX_BYTES = _build_index_html().encode("utf-8")
+
+@app.get("/", response_class=HTMLResponse)
+def index():
+    return HTMLResponse(content=_INDEX_BYTES, headers={"Cache-Control": "public, max-age=300"})
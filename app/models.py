@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Enum as SAEnum
+from sqlalchemy import Column, Integer, BigInteger, String, Float, DateTime, Enum as SAEnum, Index, CheckConstraint, text
 from sqlalchemy.sql import func
 from enum import Enum
 from .db import Base
@@ -15,6 +15,15 @@ class Watchlist(Base):
     id = Column(Integer, primary_key=True)
     symbol = Column(String(16), unique=True, index=True, nullable=False)
 
+class MicrocapUniverse(Base):
+    """Paskutinio TwelveData microcap skenavimo rezultatas (pildo dienos scheduler'io job'as)."""
+    __tablename__ = "microcap_universe"
+    id = Column(Integer, primary_key=True)
+    symbol = Column(String(16), unique=True, nullable=False)
+    # Kokiu market cap limitu skenuota – kitam limitui lentelė netinka (perskenuojama).
+    cap_limit = Column(BigInteger, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now())
+
 class Signal(Base):
     __tablename__ = "signals"
     id = Column(Integer, primary_key=True)
@@ -29,17 +38,44 @@ class Signal(Base):
     reason = Column(String(256), default="")
     rr = Column(Float, default=1.5)
     status = Column(SAEnum(SignalStatus), default=SignalStatus.NEW, nullable=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        # /api/signals: filtras pagal symbol (+timeframe), naujausi pirmi.
+        Index("ix_signals_symbol_tf_created", "symbol", "timeframe", created_at.desc()),
+        # Naujausi signalai (/pnl, /signals): Postgres gali skaityti vien iš indekso.
+        Index(
+            "ix_signals_created_at",
+            created_at.desc(),
+            postgresql_include=["symbol", "entry", "direction", "timeframe"],
+        ),
+    )
 
 class Position(Base):
     __tablename__ = "positions"
     id = Column(Integer, primary_key=True)
-    symbol = Column(String(16), index=True, nullable=False)
+    # Atskiro symbol indekso nereikia – jį dengia ix_positions_sym_tf_status_opened (symbol pirmas).
+    symbol = Column(String(16), nullable=False)
     timeframe = Column(String(8), nullable=False)
     entry = Column(Float, nullable=False)
     stop = Column(Float, nullable=False)
     tp1 = Column(Float, nullable=False)
     tp2 = Column(Float, nullable=False)
-    status = Column(SAEnum(PositionStatus), default=PositionStatus.OPEN, nullable=False)
+    # Paprastas VARCHAR + CHECK vietoj DB enum'o: pigesni filtrai ir galimas dalinis indeksas.
+    status = Column(String(8), default=PositionStatus.OPEN.value, nullable=False)
     opened_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
     closed_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        CheckConstraint("status IN ('OPEN', 'CLOSED')", name="ck_positions_status"),
+        # run_scan / portfolio: atviros pozicijos pagal (symbol, timeframe), naujausia pirma.
+        Index("ix_positions_sym_tf_status_opened", "symbol", "timeframe", "status", opened_at.desc()),
+        # Mažas dalinis indeksas tik atviroms pozicijoms (run_scan prefetch, /portfolio).
+        Index(
+            "ix_positions_open",
+            "symbol",
+            "timeframe",
+            postgresql_where=text("status = 'OPEN'"),
+            sqlite_where=text("status = 'OPEN'"),
+        ),
+    )
@@ -1,29 +1,55 @@
 from typing import Optional, Dict, Any
 import numpy as np
+import pandas as pd
 from .data import fetch_ohlcv
 
+# Naudojamų ilgių alpha = 2/(length+1) paskaičiuota iš anksto.
+_EMA_ALPHA = {n: 2 / (n + 1) for n in (20, 50)}
+
 def _ema(values, length):
+    """
+    EMA su alpha = 2/(length+1), pradinė reikšmė = values[0].
+    pandas ewm(adjust=False) vykdo tą pačią rekursiją C kode (be Python ciklo).
+    """
     if len(values) == 0:
         return np.array([])
-    k = 2/(length+1)
-    ema = np.zeros_like(values, dtype=float)
-    ema[0] = values[0]
-    for i in range(1, len(values)):
-        ema[i] = (values[i]-ema[i-1]) * k + ema[i-1]
-    return ema
+    alpha = _EMA_ALPHA.get(length) or 2 / (length + 1)
+    return pd.Series(values, dtype=float, copy=False).ewm(alpha=alpha, adjust=False).mean().to_numpy()
+
+# Pradinės reikšmės įtaka EMA gale nyksta kaip (1-k)^n; po 8*length barų ji < 1e-6,
+# todėl senesnės istorijos skaičiuoti nebereikia.
+_EMA_WINDOW_MULT = 8
+
+def _ema_tail(values, length):
+    """EMA tik per paskutinius _EMA_WINDOW_MULT*length barų (galas sutampa su pilna EMA)."""
+    return _ema(values[-_EMA_WINDOW_MULT * length:], length)
+
+def _indicators(closes: np.ndarray, *lengths: int) -> Dict[int, np.ndarray]:
+    """Bendras EMA skaičiavimas entry/exit logikai: {length: EMA}."""
+    return {n: _ema_tail(closes, n) for n in lengths}
+
+async def _load_closes(symbol: str, timeframe: str, closes: Optional[np.ndarray]) -> np.ndarray:
+    """Grąžina caller'io perduotas uždarymo kainas arba jas pasiima per fetch_ohlcv()."""
+    if closes is not None:
+        return np.asarray(closes, dtype=np.float64)
+    df = await fetch_ohlcv(symbol, timeframe)
+    if df.empty:
+        return np.array([])
+    # fetch_ohlcv() grąžina float64 stulpelius – tai vaizdas, ne kopija.
+    return df["close"].to_numpy(dtype=np.float64, copy=False)
 
-def compute_entry(symbol: str, timeframe: str) -> Optional[Dict[str, Any]]:
+async def compute_entry(symbol: str, timeframe: str, *, closes: Optional[np.ndarray] = None) -> Optional[Dict[str, Any]]:
     """
     Paprasta įėjimo logika:
     - BUY, kai EMA20 kerta EMA50 iš apačios į viršų.
     - SL ~5% žemiau įėjimo, TP1 ~+5%, TP2 ~+10%.
+    Jei closes perduotas – OHLCV nebeparsiunčiamas.
     """
-    df = fetch_ohlcv(symbol, timeframe)
-    if df.empty or len(df) < 60:
+    closes = await _load_closes(symbol, timeframe, closes)
+    if len(closes) < 60:
         return None
-    closes = df["close"].to_numpy(float)
-    ema20 = _ema(closes, 20)
-    ema50 = _ema(closes, 50)
+    ind = _indicators(closes, 20, 50)
+    ema20, ema50 = ind[20], ind[50]
     if len(ema20) < 2 or len(ema50) < 2:
         return None
     if not (ema20[-1] > ema50[-1] and ema20[-2] <= ema50[-2]):
@@ -46,17 +72,20 @@ def compute_entry(symbol: str, timeframe: str) -> Optional[Dict[str, Any]]:
         "rr": round((tp1-entry)/(entry-stop), 2) if entry > stop else 1.5,
     }
 
-def compute_exit(symbol: str, timeframe: str, entry: float, stop: float, tp1: float, tp2: float) -> Optional[Dict[str, Any]]:
+async def compute_exit(
+    symbol: str, timeframe: str, entry: float, stop: float, tp1: float, tp2: float,
+    *, closes: Optional[np.ndarray] = None,
+) -> Optional[Dict[str, Any]]:
     """
     Išėjimo logika:
     - SELL, jei kaina < EMA50, arba ≤ SL, arba ≥ TP2.
+    Jei closes perduotas – OHLCV nebeparsiunčiamas.
     """
-    df = fetch_ohlcv(symbol, timeframe)
-    if df.empty:
+    closes = await _load_closes(symbol, timeframe, closes)
+    if len(closes) == 0:
         return None
-    last = float(df["close"].iloc[-1])
-    closes = df["close"].to_numpy(float)
-    ema50 = _ema(closes, 50)
+    last = float(closes[-1])
+    ema50 = _indicators(closes, 50)[50]
     if len(ema50) < 1:
         return None
 
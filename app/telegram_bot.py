@@ -1,33 +1,139 @@
 import asyncio
+import io
+import textwrap
 from typing import Optional
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
 
-import requests
+from sqlalchemy import select, insert, delete, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from telegram import Update
-from telegram.ext import Application, CommandHandler, ContextTypes
+from telegram.ext import AIORateLimiter, Application, CommandHandler, ContextTypes
 
 from .config import settings
 from .db import SessionLocal
 from .models import Signal, SignalStatus, Watchlist, Position, PositionStatus
 from .schemas import PortfolioRow
-from .data import last_price
+from .data import last_prices
 
 @dataclass
 class TelegramDB:
     subscribers: set[int]
 
+# Datų / procentų formatai – moduliniai konstantai, naudojami per strftime ir %.
+_DT_FMT = "%Y-%m-%d %H:%M UTC"
+_DATE_FMT = "%Y-%m-%d"
+_NOW_FMT = "%Y-%m-%d %H:%M:%S UTC"
+
 def _fmt_pct(x: float) -> str:
-    return f"{x*100:.2f}%"
+    return "%.2f%%" % (x * 100)
 
 def _now_utc_str() -> str:
-    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')
+    return datetime.now(timezone.utc).strftime(_NOW_FMT)
+
+_PNL_LINE = "• %s %s %s: %.2f%% (entry %s → last %.2f)"
+
+# Telegram žinutės riba (4096) su atsarga "… +N more" eilutei.
+_TG_TEXT_BUDGET = 4000
+
+def _render(header: str, lines, total: int) -> str:
+    """
+    Antraštė + eilutės į vieną StringIO buferį. Eilutės (gali būti generatorius) imamos tik
+    kol telpa į Telegram žinutę – likusios nė neformatuojamos, pridedama "… +N more".
+    """
+    buf = io.StringIO()
+    buf.write(header)
+    size = len(header)
+    shown = 0
+    for line in lines:
+        if size + 1 + len(line) > _TG_TEXT_BUDGET:
+            break
+        buf.write("\n")
+        buf.write(line)
+        size += 1 + len(line)
+        shown += 1
+    if shown < total:
+        buf.write(f"\n… +{total - shown} more")
+    return buf.getvalue()
+
+# Dialektai su ON CONFLICT ir RETURNING palaikymu (kitiems – IN užklausos kelias).
+_UPSERT_INSERT = {"postgresql": pg_insert, "sqlite": sqlite_insert}
+
+def _add_watchlist(db, syms: list[str]) -> list[str]:
+    """
+    Prideda simbolius į watchlist; grąžina tik tikrai pridėtus.
+    Postgres/SQLite: vienas INSERT ... ON CONFLICT DO NOTHING RETURNING (unikalumą tikrina DB),
+    kitiems dialektams – IN užklausa + INSERT.
+    """
+    wanted = list(dict.fromkeys(syms))
+    if not wanted:
+        return []
+    ins = _UPSERT_INSERT.get(db.get_bind().dialect.name)
+    if ins is not None:
+        stmt = (
+            ins(Watchlist)
+            .values([{"symbol": s} for s in wanted])
+            .on_conflict_do_nothing(index_elements=["symbol"])
+            .returning(Watchlist.symbol)
+        )
+        inserted = set(db.execute(stmt).scalars().all())
+        to_add = [s for s in wanted if s in inserted]
+    else:
+        existing = {r[0] for r in db.query(Watchlist.symbol).filter(Watchlist.symbol.in_(wanted)).all()}
+        to_add = [s for s in wanted if s not in existing]
+        if to_add:
+            db.execute(insert(Watchlist), [{"symbol": s} for s in to_add])
+    db.commit()
+    return to_add
+
+def _remove_watchlist(db, syms: list[str]) -> list[str]:
+    """
+    Išima simbolius iš watchlist; grąžina pašalintus.
+    Postgres/SQLite: vienas DELETE ... RETURNING, kitiems dialektams – IN užklausa + DELETE.
+    """
+    stmt = delete(Watchlist).where(Watchlist.symbol.in_(syms))
+    if db.get_bind().dialect.name in _UPSERT_INSERT:
+        removed = list(db.execute(stmt.returning(Watchlist.symbol)).scalars().all())
+    else:
+        removed = [r[0] for r in db.query(Watchlist.symbol).filter(Watchlist.symbol.in_(syms)).all()]
+        if removed:
+            db.execute(stmt)
+    db.commit()
+    return removed
+
+def _with_session(fn, *args):
+    db = SessionLocal()
+    try:
+        return fn(db, *args)
+    finally:
+        db.close()
+
+async def _run_db(fn, *args):
+    """Sinchroninį DB darbą fn(db, *args) vykdo threadpool'e, kad neblokuotų bot'o event loop'o."""
+    return await asyncio.to_thread(_with_session, fn, *args)
+
+_BROADCAST_CONCURRENCY = 25
+
+def _rate_limiter() -> AIORateLimiter | None:
+    """PTB flood control (30 msg/s bendrai, 20 msg/min grupei); be aiolimiter extra – None."""
+    try:
+        return AIORateLimiter(
+            overall_max_rate=30, overall_time_period=1,
+            group_max_rate=20, group_time_period=60,
+        )
+    except RuntimeError:
+        return None
 
 class BotInstance:
     def __init__(self):
         if not settings.TELEGRAM_BOT_TOKEN:
             raise RuntimeError("TELEGRAM_BOT_TOKEN is not set")
-        self.app = Application.builder().token(settings.TELEGRAM_BOT_TOKEN).build()
+        builder = Application.builder().token(settings.TELEGRAM_BOT_TOKEN)
+        limiter = _rate_limiter()
+        if limiter is not None:
+            builder = builder.rate_limiter(limiter)
+        self.app = builder.build()
         self.db = TelegramDB(subscribers=set())
         self._configure_handlers()
 
@@ -53,8 +159,8 @@ class BotInstance:
             "👋 Welcome to Tech Signals Bot!\n"
             "Commands: /help\n"
             "/portfolio – open positions with P/L\n"
-            "/add <SYMBOL> – add symbol to watchlist\n"
-            "/remove <SYMBOL> – remove symbol from watchlist"
+            "/add <SYMBOL> [SYMBOL2 ...] – add symbols to watchlist\n"
+            "/remove <SYMBOL> [SYMBOL2 ...] – remove symbols from watchlist"
         )
 
     async def help(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -71,8 +177,8 @@ class BotInstance:
             "/watchlist [show|add|remove]\n"
             "/positions – open long positions\n"
             "/portfolio – open positions with current P/L\n"
-            "/add <SYMBOL>\n"
-            "/remove <SYMBOL>"
+            "/add <SYMBOL> [SYMBOL2 ...]\n"
+            "/remove <SYMBOL> [SYMBOL2 ...]"
         )
 
     async def subscribe(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -92,24 +198,33 @@ class BotInstance:
         await update.message.reply_text(f"pong • {_now_utc_str()} • app={settings.APP_NAME}")
 
     async def signals_overview(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        db = SessionLocal()
-        try:
-            now = datetime.utcnow()
+        def work(db) -> str:
+            now = datetime.now(timezone.utc)
             from_24h = now - timedelta(hours=24)
             from_7d = now - timedelta(days=7)
-            count_24h = db.query(Signal).filter(Signal.created_at >= from_24h).count()
-            count_7d = db.query(Signal).filter(Signal.created_at >= from_7d).count()
-            recent = db.query(Signal).order_by(Signal.created_at.desc()).limit(5).all()
-            lines = [f"📊 Signals overview", f"Last 24h: {count_24h}", f"Last 7d: {count_7d}"]
+            # Abu skaičiai viena užklausa per 7d langą (COUNT(*) FILTER (WHERE ...)).
+            count_24h, count_7d = db.execute(
+                select(func.count().filter(Signal.created_at >= from_24h), func.count())
+                .where(Signal.created_at >= from_7d)
+            ).one()
+            recent = (
+                db.query(
+                    Signal.symbol, Signal.timeframe, Signal.direction, Signal.entry,
+                    Signal.stop, Signal.tp1, Signal.rr, Signal.confidence,
+                )
+                .order_by(Signal.created_at.desc())
+                .limit(5)
+                .all()
+            )
+            header = f"📊 Signals overview\nLast 24h: {count_24h}\nLast 7d: {count_7d}"
             if recent:
-                lines.append("Recent:")
-                for r in recent:
-                    lines.append(
-                        f"• {r.symbol} {r.timeframe} {r.direction} @ {r.entry} | SL {r.stop} | TP1 {r.tp1} | RR {r.rr} ({r.confidence})"
-                    )
-            await update.message.reply_text("\n".join(lines))
-        finally:
-            db.close()
+                header += "\nRecent:"
+            return _render(header, (
+                f"• {r.symbol} {r.timeframe} {r.direction} @ {r.entry} | SL {r.stop} | TP1 {r.tp1} | RR {r.rr} ({r.confidence})"
+                for r in recent
+            ), len(recent))
+
+        await update.message.reply_text(await _run_db(work))
 
     async def last_signal(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         args = context.args
@@ -118,166 +233,181 @@ class BotInstance:
             return
         symbol = args[0].upper()
         tf = args[1] if len(args) > 1 else None
-        db = SessionLocal()
-        try:
+
+        def work(db) -> str:
             q = db.query(Signal).filter(Signal.symbol == symbol)
             if tf:
                 q = q.filter(Signal.timeframe == tf)
             row = q.order_by(Signal.created_at.desc()).first()
             if not row:
-                await update.message.reply_text(f"No signals found for {symbol}{' '+tf if tf else ''}.")
-                return
-            txt = (
+                return f"No signals found for {symbol}{' '+tf if tf else ''}."
+            return (
                 f"[{row.direction}] {row.symbol} ({row.timeframe})\n"
                 f"Entry: {row.entry} | SL: {row.stop} | TP1: {row.tp1} | TP2: {row.tp2}\n"
                 f"Reason: {row.reason}\nConfidence: {row.confidence} | R:R: {row.rr}\n"
-                f"Time: {row.created_at:%Y-%m-%d %H:%M UTC}"
+                f"Time: {row.created_at.strftime(_DT_FMT)}"
             )
-            await update.message.reply_text(txt)
-        finally:
-            db.close()
+
+        await update.message.reply_text(await _run_db(work))
 
     async def pnl(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         try:
             N = int(context.args[0]) if context.args else 20
         except Exception:
             N = 20
-        db = SessionLocal()
-        try:
-            signals = db.query(Signal).order_by(Signal.created_at.desc()).limit(N).all()
-            if not signals:
-                await update.message.reply_text("No signals to evaluate.")
-                return
-            total_pct = 0.0
-            wins = 0
-            evaluated = 0
-            parts = []
-            for s in signals:
-                price = last_price(s.symbol)
-                if price is None or s.entry == 0:
-                    continue
-                change = (price - s.entry) / s.entry if s.direction == "BUY" else (s.entry - price) / s.entry
-                total_pct += change
-                evaluated += 1
-                wins += 1 if change > 0 else 0
-                parts.append(f"• {s.symbol} {s.timeframe} {s.direction}: {(change*100):.2f}% (entry {s.entry} → last {price:.2f})")
-            if evaluated == 0:
-                await update.message.reply_text("Could not fetch prices right now. Try again later.")
-                return
-            avg = total_pct / evaluated
-            win_rate = wins / evaluated
-            header = f"💹 Unrealized P&L (last {evaluated} signals)\nAvg: {(avg*100):.2f}% | Win rate: {(win_rate*100):.2f}%"
-            await update.message.reply_text("\n".join([header] + parts[:20]))
-        finally:
-            db.close()
+        def work(db):
+            # Tik naudojami stulpeliai – lengvos eilutės vietoj ORM objektų.
+            return (
+                db.query(Signal.symbol, Signal.entry, Signal.direction, Signal.timeframe)
+                .order_by(Signal.created_at.desc())
+                .limit(N)
+                .all()
+            )
+
+        signals = await _run_db(work)
+        if not signals:
+            await update.message.reply_text("No signals to evaluate.")
+            return
+        # Visų simbolių kainos vienu batch kvietimu (TD /price, Yahoo quote, chart).
+        prices = await last_prices([s.symbol for s in signals])
+        total_pct = 0.0
+        wins = 0
+        evaluated = 0
+        parts = []
+        for sym, entry, direction, tf in signals:
+            price = prices.get(sym)
+            if price is None or entry == 0:
+                continue
+            change = (price - entry) / entry if direction == "BUY" else (entry - price) / entry
+            total_pct += change
+            evaluated += 1
+            wins += 1 if change > 0 else 0
+            # Rodomos tik pirmos 20 eilučių – likusių nė neformatuojam.
+            if len(parts) < 20:
+                parts.append(_PNL_LINE % (sym, tf, direction, change * 100, entry, price))
+        if evaluated == 0:
+            await update.message.reply_text("Could not fetch prices right now. Try again later.")
+            return
+        avg = total_pct / evaluated
+        win_rate = wins / evaluated
+        header = f"💹 Unrealized P&L (last {evaluated} signals)\nAvg: {(avg*100):.2f}% | Win rate: {(win_rate*100):.2f}%"
+        await update.message.reply_text(_render(header, parts, len(parts)))
 
     async def watchlist(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         subcmd = (context.args[0].lower() if context.args else "show")
-        db = SessionLocal()
-        try:
-            if subcmd == "show":
-                rows = db.query(Watchlist).order_by(Watchlist.symbol.asc()).all()
-                syms = [r.symbol for r in rows]
-                if not syms:
-                    await update.message.reply_text("Watchlist is empty.")
-                else:
-                    out, chunk = [], []
-                    for s in syms:
-                        chunk.append(s)
-                        if len(chunk) == 25:
-                            out.append(", ".join(chunk)); chunk = []
-                    if chunk: out.append(", ".join(chunk))
-                    await update.message.reply_text("👀 Watchlist:\n" + "\n".join(out))
-            elif subcmd == "add":
-                syms = [s.upper() for s in context.args[1:]]
-                if not syms:
-                    await update.message.reply_text("Usage: /watchlist add SYMBOL [SYMBOL2 ...]"); return
-                added = 0
-                for s in syms:
-                    if not db.query(Watchlist).filter_by(symbol=s).first():
-                        db.add(Watchlist(symbol=s)); added += 1
-                db.commit()
-                await update.message.reply_text(f"✅ Added {added} symbol(s). Use /watchlist show to view.")
-            elif subcmd == "remove":
-                syms = [s.upper() for s in context.args[1:]]
-                if not syms:
-                    await update.message.reply_text("Usage: /watchlist remove SYMBOL [SYMBOL2 ...]"); return
-                removed = 0
-                for s in syms:
-                    row = db.query(Watchlist).filter_by(symbol=s).first()
-                    if row:
-                        db.delete(row); removed += 1
-                db.commit()
-                await update.message.reply_text(f"🗑️ Removed {removed} symbol(s).")
+        if subcmd == "show":
+            def show(db) -> list[str]:
+                return [r[0] for r in db.query(Watchlist.symbol).order_by(Watchlist.symbol.asc()).all()]
+
+            syms = await _run_db(show)
+            if not syms:
+                await update.message.reply_text("Watchlist is empty.")
             else:
-                await update.message.reply_text("Usage: /watchlist [show|add|remove] ...")
-        finally:
-            db.close()
+                # Telegram žinutė ribojama 4096 simboliais – ilgą sąrašą siunčiam dalimis.
+                chunks = textwrap.wrap(", ".join(syms), width=3900, break_long_words=False, break_on_hyphens=False)
+                await update.message.reply_text("👀 Watchlist:\n" + chunks[0])
+                for chunk in chunks[1:]:
+                    await update.message.reply_text(chunk)
+        elif subcmd == "add":
+            syms = [s.upper() for s in context.args[1:]]
+            if not syms:
+                await update.message.reply_text("Usage: /watchlist add SYMBOL [SYMBOL2 ...]"); return
+
+            added = await _run_db(_add_watchlist, syms)
+            await update.message.reply_text(f"✅ Added {len(added)} symbol(s). Use /watchlist show to view.")
+        elif subcmd == "remove":
+            syms = [s.upper() for s in context.args[1:]]
+            if not syms:
+                await update.message.reply_text("Usage: /watchlist remove SYMBOL [SYMBOL2 ...]"); return
+
+            removed = await _run_db(_remove_watchlist, syms)
+            await update.message.reply_text(f"🗑️ Removed {len(removed)} symbol(s).")
+        else:
+            await update.message.reply_text("Usage: /watchlist [show|add|remove] ...")
 
     async def positions(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        db = SessionLocal()
-        try:
-            rows = db.query(Position).filter_by(status=PositionStatus.OPEN).order_by(Position.opened_at.asc()).all()
+        def work(db) -> str:
+            rows = (
+                db.query(
+                    Position.symbol, Position.timeframe, Position.entry, Position.stop,
+                    Position.tp1, Position.tp2, Position.opened_at,
+                )
+                .filter(Position.status == PositionStatus.OPEN)
+                .order_by(Position.opened_at.asc())
+                .all()
+            )
             if not rows:
-                await update.message.reply_text("No open positions."); return
-            out = ["📌 Open positions:"]
-            for r in rows:
-                out.append(f"• {r.symbol} {r.timeframe} @ {r.entry} | SL {r.stop} | TP1 {r.tp1} | TP2 {r.tp2} (since {r.opened_at:%Y-%m-%d})")
-            await update.message.reply_text("\n".join(out))
-        finally:
-            db.close()
+                return "No open positions."
+            return _render("📌 Open positions:", (
+                f"• {r.symbol} {r.timeframe} @ {r.entry} | SL {r.stop} | TP1 {r.tp1} | TP2 {r.tp2} (since {r.opened_at.strftime(_DATE_FMT)})"
+                for r in rows
+            ), len(rows))
+
+        await update.message.reply_text(await _run_db(work))
 
     async def portfolio(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        db = SessionLocal()
-        try:
-            rows = db.query(Position).filter_by(status=PositionStatus.OPEN).all()
-            if not rows:
-                await update.message.reply_text("Portfolio is empty (no open positions)."); return
-            parts = ["💼 Portfolio (open):"]
+        def work(db):
+            return (
+                db.query(Position.symbol, Position.timeframe, Position.entry)
+                .filter(Position.status == PositionStatus.OPEN)
+                .all()
+            )
+
+        rows = await _run_db(work)
+        if not rows:
+            await update.message.reply_text("Portfolio is empty (no open positions)."); return
+        # Visų pozicijų kainos vienu batch kvietimu.
+        prices = await last_prices([r.symbol for r in rows])
+
+        def lines():
             for r in rows:
-                lp = last_price(r.symbol)
+                lp = prices.get(r.symbol)
                 ch = ((lp - r.entry) / r.entry) if (lp and r.entry) else None
-                parts.append(f"• {r.symbol} {r.timeframe} @ {r.entry:.2f} → last {lp:.2f if lp else float('nan')}"
-                             + (f" | {(_fmt_pct(ch))}" if ch is not None else ""))
-            await update.message.reply_text("\n".join(parts))
-        finally:
-            db.close()
+                lp_s = f"{lp:.2f}" if lp else "n/a"
+                ch_s = f" | {_fmt_pct(ch)}" if ch is not None else ""
+                yield f"• {r.symbol} {r.timeframe} @ {r.entry:.2f} → last {lp_s}{ch_s}"
+
+        await update.message.reply_text(_render("💼 Portfolio (open):", lines(), len(rows)))
 
     async def add_symbol(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not context.args:
-            await update.message.reply_text("Usage: /add <SYMBOL>"); return
-        sym = context.args[0].strip().upper()
-        db = SessionLocal()
-        try:
-            if not db.query(Watchlist).filter_by(symbol=sym).first():
-                db.add(Watchlist(symbol=sym)); db.commit()
-                await update.message.reply_text(f"✅ Added {sym} to watchlist.")
-            else:
-                await update.message.reply_text(f"ℹ️ {sym} already in watchlist.")
-        finally:
-            db.close()
+            await update.message.reply_text("Usage: /add <SYMBOL> [SYMBOL2 ...]"); return
+        syms = [a.strip().upper() for a in context.args if a.strip()]
+        added = await _run_db(_add_watchlist, syms)
+        skipped = [s for s in dict.fromkeys(syms) if s not in added]
+        lines = []
+        if added:
+            lines.append(f"✅ Added {', '.join(added)} to watchlist.")
+        if skipped:
+            lines.append(f"ℹ️ {', '.join(skipped)} already in watchlist.")
+        await update.message.reply_text("\n".join(lines))
 
     async def remove_symbol(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not context.args:
-            await update.message.reply_text("Usage: /remove <SYMBOL>"); return
-        sym = context.args[0].strip().upper()
-        db = SessionLocal()
-        try:
-            row = db.query(Watchlist).filter_by(symbol=sym).first()
-            if row:
-                db.delete(row); db.commit()
-                await update.message.reply_text(f"🗑️ Removed {sym}.")
-            else:
-                await update.message.reply_text(f"ℹ️ {sym} not found.")
-        finally:
-            db.close()
+            await update.message.reply_text("Usage: /remove <SYMBOL> [SYMBOL2 ...]"); return
+        syms = [a.strip().upper() for a in context.args if a.strip()]
+        removed = await _run_db(_remove_watchlist, syms)
+        missing = [s for s in dict.fromkeys(syms) if s not in removed]
+        lines = []
+        if removed:
+            lines.append(f"🗑️ Removed {', '.join(removed)}.")
+        if missing:
+            lines.append(f"ℹ️ {', '.join(missing)} not found.")
+        await update.message.reply_text("\n".join(lines))
 
     async def broadcast(self, text: str):
-        for chat_id in list(self.db.subscribers):
-            try:
-                await self.app.bot.send_message(chat_id=chat_id, text=text)
-            except Exception:
-                pass
+        # Lygiagrečiai, bet ne daugiau _BROADCAST_CONCURRENCY vienu metu (Telegram ~30 msg/s);
+        # vieno gavėjo klaida kitų neblokuoja.
+        sem = asyncio.Semaphore(_BROADCAST_CONCURRENCY)
+
+        async def _safe_send(chat_id: int):
+            async with sem:
+                try:
+                    await self.app.bot.send_message(chat_id=chat_id, text=text)
+                except Exception:
+                    pass
+
+        await asyncio.gather(*(_safe_send(c) for c in list(self.db.subscribers)))
 
     async def run_polling(self):
         await self.app.initialize()
@@ -1,11 +1,21 @@
 # app/universe.py
 from __future__ import annotations
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator
+from datetime import datetime, timezone
+from pathlib import Path
+import json
 import time
 import math
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from .config import settings
+from .data import td_take
 
 TD_KEY = settings.TWELVEDATA_API_KEY.strip()
 BASE = "https://api.twelvedata.com"
@@ -16,46 +26,91 @@ _session.headers.update({
     "Accept": "application/json, text/plain, */*",
     "Connection": "keep-alive",
 })
+# Vienas hostas (api.twelvedata.com): didesnis keep-alive pool'as lygiagretiems /profile
+# kvietimams + retry'ai laikiniems 429/5xx (raise_on_status=False – grąžina paskutinį atsaką).
+_session.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=32,
+    pool_block=False,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=(429, 500, 502, 503, 504),
+        raise_on_status=False,
+    ),
+))
 
-# Paprastas limiteris – tas pats principas kaip data.py, bet atskiras čia,
-# kad nebūtų ciklinių importų.
-_minute_start = 0.0
-_minute_count = 0
-_day_start = 0.0
-_day_count = 0
+class UniverseScanIncomplete(RuntimeError):
+    """Skenas nutrauktas (baigėsi TD dienos limitas ar shutdown) – dalinis rezultatas netinka."""
+
+# Universe atnaujinimai vyksta gijose (threadpool + td-profile pool'as), jų asyncio
+# cancel nesustabdo: shutdown metu nustatom _stop ir laukiam, kol aktyvūs baigs.
+_stop = threading.Event()
+_active = 0
+_active_cv = threading.Condition()
+
+@contextmanager
+def refresh_guard():
+    """Žymi vykstantį universe/watchlist atnaujinimą (kad shutdown galėtų jo palaukti)."""
+    global _active
+    with _active_cv:
+        if _stop.is_set():
+            raise UniverseScanIncomplete("shutting down")
+        _active += 1
+    try:
+        yield
+    finally:
+        with _active_cv:
+            _active -= 1
+            _active_cv.notify_all()
+
+def resume_refreshes() -> None:
+    """Leidžia atnaujinimus (FastAPI lifespan pradžioje)."""
+    _stop.clear()
+
+def stop_refreshes(timeout: float) -> bool:
+    """Paprašo sustoti ir laukia iki timeout; True – aktyvių atnaujinimų nebeliko."""
+    _stop.set()
+    with _active_cv:
+        return _active_cv.wait_for(lambda: _active == 0, timeout=timeout)
+
+def close_session() -> None:
+    """Uždaro bendrą requests sesiją (kviečiama iš FastAPI lifespan)."""
+    _session.close()
 
 def _now() -> float:
     return time.time()
 
-def _td_allow() -> bool:
-    global _minute_start, _minute_count, _day_start, _day_count
-    t = _now()
-    if t - _minute_start >= 60:
-        _minute_start = t
-        _minute_count = 0
-    if t - _day_start >= 86400:
-        _day_start = t
-        _day_count = 0
-    if _minute_count < settings.TD_MAX_PER_MINUTE and _day_count < settings.TD_MAX_PER_DAY:
-        _minute_count += 1
-        _day_count += 1
-        return True
-    return False
-
-def _throttle_sleep():
-    """Jei viršijam per minutę – miegam iki naujo lango."""
-    global _minute_start, _minute_count
-    t = _now()
-    wait = max(0.0, 60 - (t - _minute_start))
-    if wait > 0 and _minute_count >= settings.TD_MAX_PER_MINUTE:
-        time.sleep(wait)
+# TD limitai bendri su data.py (tie patys token bucket'ai), bet universe skenas gali
+# išnaudoti tik UNIVERSE_TD_SHARE jų dalį – likutis lieka scan'ams ir kainoms.
+def _td_try() -> float | None:
+    """
+    Bando paimti TD žetoną: 0.0 – leista; >0 – kiek sekundžių palaukti iki laisvos
+    minutės vietos; None – dienos limitas (universe daliai) išnaudotas.
+    """
+    wait = td_take(1, share=settings.UNIVERSE_TD_SHARE)
+    return None if math.isinf(wait) else wait
+
+def _td_acquire() -> bool:
+    """
+    Laukia, kol minutės kibire atsiras žetonas (gijos pabudusios kartu bando iš naujo,
+    kol gauna savo). False – tik kai išnaudotas dienos limitas.
+    """
+    while True:
+        if _stop.is_set():
+            raise UniverseScanIncomplete("shutting down")
+        wait = _td_try()
+        if wait is None:
+            return False
+        if wait == 0.0:
+            return True
+        _stop.wait(wait)
 
 def _get(path: str, params: Dict[str, Any]) -> Dict[str, Any] | None:
-    if not _td_allow():
-        _throttle_sleep()
-        if not _td_allow():
-            # jeigu ir po miego negalim – vėliau bandysim grįžti caller'yje
-            return None
+    if not _td_acquire():
+        # Dalinio sąrašo negalima laikyti pilnu universe – nutraukiam visą skenavimą,
+        # kad nebūtų perrašyti cache / microcap_universe / watchlist.
+        raise UniverseScanIncomplete("TwelveData daily limit reached")
     try:
         r = _session.get(f"{BASE}{path}", params=params, timeout=20)
         if r.status_code != 200:
@@ -64,9 +119,8 @@ def _get(path: str, params: Dict[str, Any]) -> Dict[str, Any] | None:
     except Exception:
         return None
 
-def _list_exchange_symbols(exchange: str) -> List[str]:
-    """Gražina visus simbolius iš nurodyto mainų sąrašo (US)."""
-    out: List[str] = []
+def _iter_exchange_symbols(exchange: str) -> Iterator[str]:
+    """Generuoja simbolius iš nurodyto mainų sąrašo (US) puslapis po puslapio."""
     page = 1
     while True:
         data = _get("/stocks", {
@@ -85,7 +139,7 @@ def _list_exchange_symbols(exchange: str) -> List[str]:
         for it in items:
             sym = (it.get("symbol") or "").strip().upper()
             if sym:
-                out.append(sym)
+                yield sym
         nxt = data.get("next_page")
         if not nxt:
             break
@@ -93,80 +147,186 @@ def _list_exchange_symbols(exchange: str) -> List[str]:
         # Saugiai
         if page > 200:
             break
-    return out
 
-def _profile(symbol: str) -> Dict[str, Any] | None:
-    """Gauti profilį – sektorius, šalis, market cap."""
+# /profile cache: symbol -> [fetched_at, profilis]. Sektorius/šalis/market cap kinta retai,
+# todėl profilius laikom diske PROFILE_CACHE_TTL ir kartotiniai skenai nebeeikvoja TD kvotos.
+_PROFILE_KEYS = ("sector", "Sector", "country", "Country",
+                 "market_cap", "market_capitalization", "Market Capitalization")
+_profile_cache: Dict[str, list] | None = None
+
+def _profile_cache_path() -> Path:
+    return Path(settings.UNIVERSE_CACHE_DIR) / "profiles.json"
+
+def _load_profile_cache() -> Dict[str, list]:
+    global _profile_cache
+    if _profile_cache is None:
+        try:
+            data = json.loads(_profile_cache_path().read_text())
+            _profile_cache = data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            _profile_cache = {}
+    return _profile_cache
+
+def _save_profile_cache() -> None:
+    global _profile_cache
+    if _profile_cache is None:
+        return
+    # pasenusių įrašų diske nelaikom
+    cutoff = _now() - settings.PROFILE_CACHE_TTL
+    _profile_cache = {k: v for k, v in _profile_cache.items() if v[0] >= cutoff}
+    try:
+        path = _profile_cache_path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(_profile_cache))
+        tmp.replace(path)
+    except OSError:
+        pass
+
+def _profile(symbol: str, force: bool = False) -> Dict[str, Any] | None:
+    """Gauti profilį – sektorius, šalis, market cap (iš disko cache, jei šviežias)."""
+    cache = _load_profile_cache()
+    hit = cache.get(symbol)
+    if not force and hit and _now() - hit[0] < settings.PROFILE_CACHE_TTL:
+        return hit[1]
     data = _get("/profile", {"symbol": symbol, "apikey": TD_KEY})
-    if not data:
+    # TD klaidas (kreditai, limitai) gali grąžinti su HTTP 200 – tokių necache'inam
+    if not data or data.get("status") == "error":
         return None
     # Tikėtini laukai: 'sector', 'country', 'market_cap' (arba 'market_capitalization')
-    return data
+    prof = {k: data[k] for k in _PROFILE_KEYS if k in data}
+    if not prof:
+        return None
+    cache[symbol] = [_now(), prof]
+    return prof
+
+_CAP_MULT = {"B": 1_000_000_000.0, "M": 1_000_000.0, "K": 1_000.0}
 
 def _parse_market_cap(val: Any) -> float | None:
     if val is None:
         return None
-    # Gali būti string "123456789" ar float/int
-    try:
+    # Skaičiai – iškart; eilutės ("123456789", "123.45M", "1.2B") – pagal galūnę, be try/except maršrutizavimo
+    if isinstance(val, (int, float)):
         return float(val)
-    except Exception:
-        # kartais būna kaip "123.45M" ar "1.2B"
-        s = str(val).strip().upper().replace(",", "")
-        mult = 1.0
-        if s.endswith("B"):
-            mult = 1_000_000_000.0
-            s = s[:-1]
-        elif s.endswith("M"):
-            mult = 1_000_000.0
-            s = s[:-1]
-        elif s.endswith("K"):
-            mult = 1_000.0
-            s = s[:-1]
+    s = str(val).strip().upper().replace(",", "")
+    mult = _CAP_MULT.get(s[-1:])
+    if mult is not None:
+        s = s[:-1]
+    try:
+        return float(s) * (mult or 1.0)
+    except ValueError:
+        return None
+
+# Universe cache: atmintyje (tam pačiam procesui) ir diske (išgyvena restart'ą).
+# Raktas – UTC data + cap limitas, nes universe per dieną praktiškai nekinta.
+_universe_mem: Dict[tuple, List[str]] = {}
+
+def _universe_cache_path(day: str, limit_cap: int) -> Path:
+    return Path(settings.UNIVERSE_CACHE_DIR) / f"universe_{day}_{limit_cap}.json"
+
+def _purge_universe_cache(max_age: float = 86400) -> None:
+    """Ištrina senesnius nei parą universe failus."""
+    now = _now()
+    for p in Path(settings.UNIVERSE_CACHE_DIR).glob("universe_*.json"):
         try:
-            return float(s) * mult
-        except Exception:
-            return None
+            if now - p.stat().st_mtime > max_age:
+                p.unlink()
+        except OSError:
+            pass
 
-def fetch_tech_microcaps(limit_cap: int = 300_000_000) -> List[str]:
+def fetch_tech_microcaps(limit_cap: int = 300_000_000, force: bool = False) -> List[str]:
     """
     Surenka visus JAV (United States) technologijų sektoriaus simbolius
     (NASDAQ, NYSE, AMEX) ir filtruoja market cap < limit_cap.
     Naudoja TwelveData /stocks + /profile. Gerbia TD rate limitus.
+    Rezultatas cache'inamas parai (atmintyje ir UNIVERSE_CACHE_DIR faile),
+    profiliai – PROFILE_CACHE_TTL. force=True apeina abu cache.
+    Pritrūkus TD limitų kelia UniverseScanIncomplete (nieko necache'inant).
     """
     if not TD_KEY:
         # be raktų – nieko negrąžinam
         return []
 
-    exchanges = ["NASDAQ", "NYSE", "AMEX"]
-    symbols: List[str] = []
+    day = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    key = (day, int(limit_cap))
+    path = _universe_cache_path(*key)
+    if not force:
+        if key in _universe_mem:
+            return list(_universe_mem[key])
+        try:
+            cached = json.loads(path.read_text())
+            if isinstance(cached, list) and cached:
+                _universe_mem[key] = cached
+                return list(cached)
+        except (OSError, ValueError):
+            pass
+
+    selected = _scan_tech_microcaps(limit_cap, force=force)
+    if _stop.is_set():
+        raise UniverseScanIncomplete("shutting down")
+    if selected:
+        # tuščio rezultato (pvz. pritrūko limitų) necache'inam
+        _universe_mem.clear()
+        _universe_mem[key] = selected
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            _purge_universe_cache()
+            path.write_text(json.dumps(selected))
+        except OSError:
+            pass
+    return list(selected)
+
+# Gijų skaičius /profile kvietimams: daugiau nei ~ketvirtis minutės limito tik lauktų žetono.
+_PROFILE_WORKERS = max(1, min(16, settings.TD_MAX_PER_MINUTE // 4))
+# Kiek simbolių vienu metu paduodama pool'ui (tarp porcijų tikrinamas ankstyvas sustojimas).
+_PROFILE_CHUNK = _PROFILE_WORKERS * 8
+
+def _iter_universe_symbols(exchanges: List[str]) -> Iterator[str]:
+    """Unikalūs simboliai iš visų mainų (tvarka išlaikoma), srautu – be viso sąrašo atmintyje."""
+    seen: set[str] = set()
     for ex in exchanges:
-        syms = _list_exchange_symbols(ex)
-        symbols.extend(syms)
+        for sym in _iter_exchange_symbols(ex):
+            if sym not in seen:
+                seen.add(sym)
+                yield sym
 
-    symbols = list(dict.fromkeys(symbols))  # uniq, preserve order
+def _scan_tech_microcaps(limit_cap: int, force: bool = False) -> List[str]:
+    """Pilnas universe perskenavimas per TD /stocks + /profile (be cache)."""
+    symbols = _iter_universe_symbols(["NASDAQ", "NYSE", "AMEX"])
     selected: List[str] = []
 
-    for i, sym in enumerate(symbols, 1):
-        p = _profile(sym)
-        if not p:
-            continue
-
-        # TwelveData /profile formatai gali skirtis, pabandome kelis raktus
-        sector = (p.get("sector") or p.get("Sector") or "").strip()
-        country = (p.get("country") or p.get("Country") or "").strip()
-        mc = _parse_market_cap(p.get("market_cap") or p.get("market_capitalization") or p.get("Market Capitalization"))
+    # /profile kvietimai lygiagrečiai (GIL atleidžiamas laukiant tinklo); kiekvieną
+    # kvietimą vis tiek saugo _td_acquire per _get, tad TD limitai išlieka.
+    # Simboliai imami porcijomis iš generatoriaus – sustojus anksčiau, likę /stocks
+    # puslapiai nebesiunčiami.
+    ex = ThreadPoolExecutor(max_workers=_PROFILE_WORKERS, thread_name_prefix="td-profile")
+    try:
+        while len(selected) <= 2000:
+            if _stop.is_set():
+                raise UniverseScanIncomplete("shutting down")
+            chunk = list(islice(symbols, _PROFILE_CHUNK))
+            if not chunk:
+                break
+            for sym, p in zip(chunk, ex.map(lambda s: _profile(s, force), chunk)):
+                if not p:
+                    continue
 
-        if sector.lower() == "technology" and country.lower() in ("united states", "usa", "us"):
-            if mc is not None and mc < float(limit_cap):
-                selected.append(sym)
+                # TwelveData /profile formatai gali skirtis, pabandome kelis raktus
+                sector = (p.get("sector") or p.get("Sector") or "").strip()
+                country = (p.get("country") or p.get("Country") or "").strip()
+                mc = _parse_market_cap(p.get("market_cap") or p.get("market_capitalization") or p.get("Market Capitalization"))
 
-        # Kad neperžengtume min limitų – pritaikom saugiklius
-        if i % settings.TD_MAX_PER_MINUTE == 0:
-            _throttle_sleep()
+                if sector.lower() == "technology" and country.lower() in ("united states", "usa", "us"):
+                    if mc is not None and mc < float(limit_cap):
+                        selected.append(sym)
 
-        # Papildomas saugiklis nuo bereikalingo ilgo skenavimo:
-        # jeigu jau surinkom > 2000 mikrocap'ų — stabdom (labai daug realiai nereikės).
-        if len(selected) > 2000:
-            break
+                # Papildomas saugiklis nuo bereikalingo ilgo skenavimo:
+                # jeigu jau surinkom > 2000 mikrocap'ų — stabdom (labai daug realiai nereikės).
+                if len(selected) > 2000:
+                    break
+    finally:
+        # nutraukus anksčiau – likusių /profile kvietimų nebevykdom
+        ex.shutdown(wait=True, cancel_futures=True)
+        _save_profile_cache()
 
     return selected